@@ -42,7 +42,11 @@ setup(
         ]
     ),
     scripts=[],
-    entry_points={},
+    entry_points={
+        "console_scripts": [
+            "xbee-helper = xbee_helper.cli:main"
+        ]
+    },
     include_package_data=True,
     setup_requires='pytest-runner',
     tests_require='pytest',
@@ -0,0 +1,221 @@
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+
+from xbee_helper import cancellation, capture, const, exceptions
+from xbee_helper.device import ZigBee, hex_to_int
+
+
+class SimulatedRadio(object):
+    """
+    Serial port stand-in for a local XBee which answers AT commands. Bytes
+    take 10 bits of wire time each at the radio's baud rate, and are garbled
+    if the port and radio rates differ or the radio is at an `unreliable`
+    rate. At a `bad_readback` rate, bytes get through but BD reads back the
+    wrong value. With `drop_set_reply`, the radio switches rate without
+    answering the command which set it.
+    """
+    BAUDRATES = (9600, 19200, 38400, 57600, 115200)
+
+    def __init__(
+            self, unreliable=(), bad_readback=(), switches=True,
+            drop_set_reply=False):
+        self.baudrate = 9600
+        self.radio_bd = 3
+        self.unreliable = unreliable
+        self.bad_readback = bad_readback
+        self.switches = switches
+        self.drop_set_reply = drop_set_reply
+        self.params = {b"WR": b""}
+        self.wire_time = 0
+        self._incoming = []
+        self._buffer = bytearray()
+        self._splitter = capture.FrameSplitter()
+        self._lock = threading.Lock()
+
+    @property
+    def radio_rate(self):
+        return const.BAUD_RATES[self.radio_bd]
+
+    def _link_ok(self, rate=None):
+        rate = rate or self.radio_rate
+        return self.baudrate == rate and rate not in self.unreliable
+
+    def _wire(self, size):
+        seconds = size * 10.0 / self.radio_rate
+        self.wire_time += seconds
+        return seconds
+
+    def inWaiting(self):
+        now = time.time()
+        with self._lock:
+            while self._incoming and self._incoming[0][0] <= now:
+                due, data, rate = self._incoming.pop(0)
+                self._buffer.extend(
+                    data if self._link_ok(rate) else b"\xff" * len(data))
+            return len(self._buffer)
+
+    def read(self, size=1):
+        self.inWaiting()
+        with self._lock:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        return data
+
+    def write(self, data):
+        due = time.time() + self._wire(len(data))
+        if not self._link_ok():
+            return
+        for frame in self._splitter.feed(data):
+            frame = bytearray(frame)
+            command, parameter = bytes(frame[2:4]), bytes(frame[4:])
+            if command == b"BD":
+                value = b"" if parameter else bytearray((
+                    0 if self.radio_rate in self.bad_readback
+                    else self.radio_bd,))
+            else:
+                value = self.params[command]
+            response = capture.build_frame(
+                bytearray((0x88, frame[1])) + bytearray(command) +
+                b"\x00" + bytearray(value))
+            due += self._wire(len(response))
+            setting = command == b"BD" and parameter
+            if not (setting and self.drop_set_reply):
+                with self._lock:
+                    self._incoming.append((due, response, self.radio_rate))
+            if setting and self.switches:
+                self.radio_bd = bytearray(parameter)[0]
+
+
+@pytest.fixture(autouse=True)
+def short_timeout(monkeypatch):
+    monkeypatch.setattr(const, "RX_TIMEOUT", timedelta(seconds=0.5))
+
+
+def test_upgrade(request):
+    """
+    Should switch both ends to the fastest common rate and verify the link.
+    """
+    radio = SimulatedRadio()
+    zigbee = ZigBee(radio)
+    request.addfinalizer(zigbee.zb.halt)
+    assert zigbee.upgrade_baud_rate() == 115200
+    assert radio.radio_rate == 115200
+    before = radio.wire_time
+    zigbee._get_parameter(b"BD")
+    assert radio.wire_time - before < 0.002
+
+
+def test_upgrade_max_baudrate(request):
+    """
+    Should not go above max_baudrate.
+    """
+    radio = SimulatedRadio()
+    zigbee = ZigBee(radio)
+    request.addfinalizer(zigbee.zb.halt)
+    assert zigbee.upgrade_baud_rate(max_baudrate=38400) == 38400
+
+
+def test_upgrade_link_lost(request):
+    """
+    Should raise ZigBeeBaudRateError if the device switched but can't be
+    reached at either rate, since it can't be told to switch back.
+    """
+    radio = SimulatedRadio(unreliable=(115200,))
+    zigbee = ZigBee(radio)
+    request.addfinalizer(zigbee.zb.halt)
+    with pytest.raises(exceptions.ZigBeeBaudRateError):
+        zigbee.upgrade_baud_rate()
+
+
+def test_upgrade_falls_back(request):
+    """
+    Should switch both ends back to the original rate if the device switched
+    but failed verification at the new one.
+    """
+    radio = SimulatedRadio(bad_readback=(115200,))
+    zigbee = ZigBee(radio)
+    request.addfinalizer(zigbee.zb.halt)
+    assert zigbee.upgrade_baud_rate() == 9600
+    assert radio.radio_rate == 9600
+    assert zigbee._get_parameter(b"BD") == b"\x03"
+
+
+def test_upgrade_set_reply_lost(request):
+    """
+    Should switch the device back to the original rate if it switched but
+    its answer to the BD command was lost.
+    """
+    radio = SimulatedRadio(drop_set_reply=True)
+    zigbee = ZigBee(radio)
+    request.addfinalizer(zigbee.zb.halt)
+    assert zigbee.upgrade_baud_rate() == 9600
+    assert radio.radio_rate == radio.baudrate == 9600
+    assert zigbee._get_parameter(b"BD") == b"\x03"
+
+
+def test_upgrade_through_capture(request, tmpdir):
+    """
+    Should change the rate of the real port when it's wrapped for capture.
+    """
+    radio = SimulatedRadio()
+    ser = capture.CaptureSerial(radio, str(tmpdir.join("capture")))
+    zigbee = ZigBee(ser)
+    request.addfinalizer(zigbee.zb.halt)
+    assert zigbee.upgrade_baud_rate() == 115200
+    assert radio.baudrate == 115200
+
+
+def check_rates_agree(zigbee, radio):
+    assert radio.baudrate == radio.radio_rate
+    assert hex_to_int(zigbee._get_parameter(b"BD")) == radio.radio_bd
+
+
+def test_upgrade_deadline(request):
+    """
+    Should stop upgrading at the deadline, wherever it falls, and leave both
+    ends at the same rate.
+    """
+    for milliseconds in range(0, 70, 10):
+        radio = SimulatedRadio()
+        zigbee = ZigBee(radio)
+        request.addfinalizer(zigbee.zb.halt)
+        try:
+            zigbee.upgrade_baud_rate(
+                deadline=timedelta(milliseconds=milliseconds))
+        except exceptions.ZigBeeResponseTimeout:
+            pass
+        check_rates_agree(zigbee, radio)
+
+
+def test_upgrade_cancel(request):
+    """
+    Should stop upgrading when the token is cancelled, wherever that falls,
+    and leave both ends at the same rate.
+    """
+    for milliseconds in range(0, 70, 10):
+        radio = SimulatedRadio()
+        zigbee = ZigBee(radio)
+        request.addfinalizer(zigbee.zb.halt)
+        token = cancellation.CancelToken()
+        timer = threading.Timer(milliseconds / 1000.0, token.cancel)
+        timer.start()
+        request.addfinalizer(timer.cancel)
+        try:
+            zigbee.upgrade_baud_rate(cancel=token)
+        except exceptions.ZigBeeCancelled:
+            pass
+        check_rates_agree(zigbee, radio)
+
+
+def test_upgrade_device_did_not_switch(request):
+    """
+    Should carry on at the original rate if the device never switched.
+    """
+    radio = SimulatedRadio(switches=False)
+    zigbee = ZigBee(radio)
+    request.addfinalizer(zigbee.zb.halt)
+    assert zigbee.upgrade_baud_rate() == 9600
+    assert zigbee._get_parameter(b"BD") == b"\x03"
@@ -0,0 +1,107 @@
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from xbee_helper import cli, exceptions
+
+
+NODE = b"\x00\x13\xa2\x00\x40\x8b\x5c\x01"
+BROKEN = b"\x00\x13\xa2\x00\x40\x8b\x5c\x02"
+
+
+class FakeZigBee(object):
+    def get_supply_voltage(self, dest_addr_long=None, **kwargs):
+        return 3.3
+
+    def get_temperature(self, dest_addr_long=None, **kwargs):
+        raise exceptions.ZigBeeResponseTimeout()
+
+    def get_node_name(self, dest_addr_long=None, **kwargs):
+        if dest_addr_long == BROKEN:
+            raise IOError("Port went away")
+        return b"node"
+
+    def get_sample(self, dest_addr_long=None, deadline=None, **kwargs):
+        self.deadline = deadline
+        return {}
+
+
+class TextStream(io.StringIO):
+    def write(self, text):
+        return super(TextStream, self).write(u"%s" % text)
+
+
+def test_address():
+    """
+    Should parse hex addresses with or without colons.
+    """
+    assert cli.address("0013a200408b5c01") == NODE
+    assert cli.address("00:13:A2:00:40:8B:5C:01") == NODE
+    for value in ("0013a200", "zz13a200408b5c01"):
+        with pytest.raises(Exception):
+            cli.address(value)
+
+
+def test_bad_arguments_exit_before_opening_port():
+    """
+    Should reject bad addresses and missing nodes as usage errors.
+    """
+    for argv in (["sweep", "nope"], ["sample"], ["sweep", "-m", "x"]):
+        with pytest.raises(SystemExit) as excinfo:
+            cli.main(argv)
+        assert excinfo.value.code == 2
+
+
+def test_sweep_streams_json_lines():
+    """
+    Should emit one JSON line per node and metric, including errors.
+    """
+    stream = TextStream()
+    args = cli.build_parser().parse_args(
+        ["sweep", "-m", "supply_voltage,temperature,node_name",
+         "0013a200408b5c01"])
+    cli.sweep(FakeZigBee(), args, cli.Output(stream))
+    records = sorted(
+        (json.loads(x) for x in stream.getvalue().splitlines()),
+        key=lambda x: x["metric"])
+    assert records == [
+        dict(node="0013a200408b5c01", metric="node_name", value="node"),
+        dict(node="0013a200408b5c01", metric="supply_voltage", value=3.3),
+        dict(node="0013a200408b5c01", metric="temperature",
+             error="ZigBeeResponseTimeout", message="")]
+
+
+def test_unexpected_error_emits_record():
+    """
+    Should emit an error record for errors which aren't ZigBeeExceptions
+    and carry on with the remaining requests.
+    """
+    stream = TextStream()
+    args = cli.build_parser().parse_args(
+        ["-w", "1", "sweep", "-m", "node_name",
+         "0013a200408b5c02", "0013a200408b5c01"])
+    cli.sweep(FakeZigBee(), args, cli.Output(stream))
+    records = [json.loads(x) for x in stream.getvalue().splitlines()]
+    assert records == [
+        dict(node="0013a200408b5c02", metric="node_name",
+             error=IOError.__name__, message="Port went away"),
+        dict(node="0013a200408b5c01", metric="node_name", value="node")]
+
+
+def test_request_deadline():
+    """
+    Should give each request --timeout seconds, cut short by --deadline.
+    """
+    zigbee = FakeZigBee()
+    args = cli.build_parser().parse_args(
+        ["-t", "30", "sample", "0013a200408b5c01"])
+    job = cli.request_job(
+        zigbee, cli.Output(TextStream()), NODE, "sample", args)
+    job()
+    remaining = zigbee.deadline - datetime.now()
+    assert timedelta(seconds=29) < remaining <= timedelta(seconds=30)
+    args.deadline_at = datetime.now() + timedelta(seconds=5)
+    job()
+    assert zigbee.deadline == args.deadline_at
@@ -1,6 +1,10 @@
+import threading
+from datetime import timedelta
+from time import sleep, time
+
 import pytest
 
-from xbee_helper import device, exceptions
+from xbee_helper import cancellation, const, device, exceptions
 
 
 def test_raise_if_error_no_status():
@@ -55,3 +59,218 @@ def test_raise_if_error_unknown_status():
     """
     with pytest.raises(exceptions.ZigBeeUnknownStatus):
         device.raise_if_error(dict(status=b"\xFF"))
+
+
+def test_raise_if_tx_error_delivered():
+    """
+    Should return None without raising if "deliver_status" is b"\x00".
+    """
+    assert device.raise_if_tx_error(dict(deliver_status=b"\x00")) is None
+
+
+def test_raise_if_tx_error_failure():
+    """
+    Should raise ZigBeeTxFailure if "deliver_status" is a known failure.
+    """
+    with pytest.raises(exceptions.ZigBeeTxFailure):
+        device.raise_if_tx_error(dict(deliver_status=b"\x21"))
+
+
+def test_raise_if_tx_error_unknown_status():
+    """
+    Should raise ZigBeeUnknownStatus if "deliver_status" is unrecognised.
+    """
+    with pytest.raises(exceptions.ZigBeeUnknownStatus):
+        device.raise_if_tx_error(dict(deliver_status=b"\xFE"))
+
+
+class FakeZigBeeDevice(object):
+    """
+    Stands in for xbee.ZigBee, answering local AT commands from `params`
+    (others go unanswered) and recording data frames instead of writing them
+    to a serial port.
+    """
+    params = {b"NP": b"\x00\x04"}
+
+    def __init__(self, ser, callback=None):
+        self.callback = callback
+        self.requests = []
+        self.sent = []
+
+    def at(self, **kwargs):
+        self.requests.append(kwargs)
+        if kwargs["command"] not in self.params:
+            return
+        self.callback(dict(
+            id="at_response", frame_id=kwargs["frame_id"],
+            command=kwargs["command"], status=b"\x00",
+            parameter=self.params[kwargs["command"]]))
+
+    def tx(self, **kwargs):
+        self.sent.append(kwargs)
+
+
+def tx_status(frame_id, status=b"\x00"):
+    return dict(id="tx_status", frame_id=frame_id, deliver_status=status)
+
+
+@pytest.fixture
+def zigbee(monkeypatch):
+    monkeypatch.setattr(device, "ZigBeeDevice", FakeZigBeeDevice)
+    return device.ZigBee(None, tx_window=2)
+
+
+def test_send_data_fragments_and_windows(zigbee):
+    """
+    Should split the payload by NP, keep at most tx_window frames in flight
+    and resolve once every fragment is delivered.
+    """
+    result = []
+    sender = threading.Thread(target=lambda: result.append(
+        zigbee.send_data(b"\x00" * 8, b"abcdefghij")))
+    sender.start()
+    sleep(0.2)
+    assert [x["data"] for x in zigbee.zb.sent] == [b"abcd", b"efgh"]
+    zigbee._frame_received(tx_status(zigbee.zb.sent[0]["frame_id"]))
+    sender.join(1)
+    assert [x["data"] for x in zigbee.zb.sent] == [b"abcd", b"efgh", b"ij"]
+    future = result[0]
+    zigbee._frame_received(tx_status(zigbee.zb.sent[1]["frame_id"]))
+    assert not future.done()
+    zigbee._frame_received(tx_status(zigbee.zb.sent[2]["frame_id"]))
+    assert len(future.result(0)) == 3
+
+
+def test_send_data_retries(zigbee):
+    """
+    Should retransmit a failed fragment and resolve once it is delivered.
+    """
+    future = zigbee.send_data(b"\x00" * 8, b"abc", retries=1)
+    zigbee._frame_received(tx_status(zigbee.zb.sent[0]["frame_id"], b"\x21"))
+    assert [x["data"] for x in zigbee.zb.sent] == [b"abc", b"abc"]
+    zigbee._frame_received(tx_status(zigbee.zb.sent[1]["frame_id"]))
+    assert len(future.result(0)) == 1
+
+
+def test_send_data_failure(zigbee):
+    """
+    Should fail the transfer with ZigBeeTxFailure once retries run out.
+    """
+    future = zigbee.send_data(b"\x00" * 8, b"abc")
+    zigbee._frame_received(tx_status(zigbee.zb.sent[0]["frame_id"], b"\x25"))
+    with pytest.raises(exceptions.ZigBeeTxFailure):
+        future.result(0)
+
+
+def test_deadline(zigbee):
+    """
+    Should give up on a request at its deadline rather than RX_TIMEOUT.
+    """
+    start = time()
+    with pytest.raises(exceptions.ZigBeeResponseTimeout):
+        zigbee.get_node_name(deadline=timedelta(seconds=0.1))
+    assert time() - start < 1
+
+
+def test_cancel_releases_frame_id(zigbee):
+    """
+    Should raise ZigBeeCancelled as soon as the token is cancelled, release
+    the frame ID and discard the late response.
+    """
+    token = cancellation.CancelToken()
+    errors = []
+
+    def request():
+        try:
+            zigbee.get_node_name(cancel=token)
+        except exceptions.ZigBeeException as exc:
+            errors.append(exc)
+
+    requester = threading.Thread(target=request)
+    requester.start()
+    sleep(0.1)
+    token.cancel()
+    requester.join(1)
+    assert isinstance(errors[0], exceptions.ZigBeeCancelled)
+    frame_id = zigbee.zb.requests[0]["frame_id"]
+    assert frame_id not in zigbee._waiters
+    zigbee._frame_received(dict(
+        id="at_response", frame_id=frame_id, command=b"NI", status=b"\x00",
+        parameter=b"late"))
+    assert frame_id not in zigbee._rx_frames
+
+
+def test_cancelled_request_not_sent(zigbee):
+    """
+    Should not send a request whose token is already cancelled.
+    """
+    token = cancellation.CancelToken()
+    token.cancel()
+    with pytest.raises(exceptions.ZigBeeCancelled):
+        zigbee.get_node_name(cancel=token)
+    assert zigbee.zb.requests == []
+
+
+def test_send_data_cancel(zigbee):
+    """
+    Should stop a transfer blocked on the window and free its slots.
+    """
+    zigbee.get_max_payload()
+    token = cancellation.CancelToken()
+    result = []
+    sender = threading.Thread(target=lambda: result.append(
+        zigbee.send_data(b"\x00" * 8, b"abcdefghij", cancel=token)))
+    sender.start()
+    sleep(0.1)
+    token.cancel()
+    sender.join(1)
+    assert len(zigbee.zb.sent) == 2
+    assert zigbee._tx_pending == {}
+    with pytest.raises(exceptions.ZigBeeCancelled):
+        result[0].result(0)
+
+
+def test_send_data_lost_tx_status(zigbee, monkeypatch):
+    """
+    Should fail the transfer and free its window slot if no tx_status
+    arrives, without another send_data call coming along.
+    """
+    monkeypatch.setattr(const, "RX_TIMEOUT", timedelta(seconds=0.3))
+    future = zigbee.send_data(b"\x00" * 8, b"abc")
+    with pytest.raises(exceptions.ZigBeeResponseTimeout):
+        future.result(2)
+    assert zigbee._tx_pending == {}
+
+
+def test_send_data_deadline(zigbee, monkeypatch):
+    """
+    Should fail the transfer at its deadline if that comes before the
+    fragment's own timeout.
+    """
+    monkeypatch.setattr(const, "RX_TIMEOUT", timedelta(seconds=5))
+    zigbee.get_max_payload()
+    start = time()
+    future = zigbee.send_data(
+        b"\x00" * 8, b"abc", deadline=timedelta(seconds=0.2))
+    with pytest.raises(exceptions.ZigBeeResponseTimeout):
+        future.result(2)
+    assert time() - start < 1
+    assert zigbee._tx_pending == {}
+
+
+def test_send_data_deadline_concurrent(zigbee, monkeypatch):
+    """
+    Should fail a transfer at its deadline even when another transfer with
+    a later expiry is already in flight.
+    """
+    monkeypatch.setattr(const, "RX_TIMEOUT", timedelta(seconds=5))
+    zigbee.get_max_payload()
+    first = zigbee.send_data(b"\x00" * 8, b"abc")
+    sleep(0.1)
+    start = time()
+    second = zigbee.send_data(
+        b"\x00" * 8, b"def", deadline=timedelta(seconds=0.2))
+    with pytest.raises(exceptions.ZigBeeResponseTimeout):
+        second.result(2)
+    assert time() - start < 1
+    assert not first.done()
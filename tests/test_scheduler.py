@@ -0,0 +1,107 @@
+import time
+
+import pytest
+
+from xbee_helper import exceptions, scheduler
+
+
+GOOD = b"\x00\x13\xa2\x00\x40\x8b\x5c\x01"
+BAD = b"\x00\x13\xa2\x00\x40\x8b\x5c\x02"
+BROKEN = b"\x00\x13\xa2\x00\x40\x8b\x5c\x03"
+
+
+class FakeZigBee(object):
+    def __init__(self):
+        self.calls = []
+
+    def get_supply_voltage(self, dest_addr_long=None, **kwargs):
+        self.calls.append(dest_addr_long)
+        if dest_addr_long == BAD:
+            raise exceptions.ZigBeeTxFailure()
+        if dest_addr_long == BROKEN:
+            raise IOError("Port went away")
+        return 3.3
+
+
+def run(sched, seconds):
+    sched.start()
+    try:
+        time.sleep(seconds)
+    finally:
+        sched.stop()
+
+
+def test_add_unknown_metric():
+    """
+    Should refuse metrics it doesn't know how to fetch.
+    """
+    with pytest.raises(ValueError):
+        scheduler.HealthScheduler(FakeZigBee()).add(GOOD, "humidity", 1)
+
+
+def test_results_and_backoff():
+    """
+    Should poll each node once per interval, deliver results to the callback
+    and back off a failing node.
+    """
+    zigbee = FakeZigBee()
+    results = []
+    sched = scheduler.HealthScheduler(zigbee, callback=results.append)
+    sched.add(GOOD, "supply_voltage", 0.05)
+    sched.add(BAD, "supply_voltage", 0.05)
+    run(sched, 0.5)
+    good = [x for x in results if x.dest_addr_long == GOOD]
+    bad = [x for x in results if x.dest_addr_long == BAD]
+    assert 7 <= len(good) <= 11
+    assert all(x.value == 3.3 and x.error is None for x in good)
+    # Backed off to 0.1s, 0.2s then 0.4s after each failure.
+    assert 1 <= len(bad) <= 3
+    assert all(
+        isinstance(x.error, exceptions.ZigBeeTxFailure) for x in bad)
+
+
+def test_remove():
+    """
+    Should stop polling a job once it's removed.
+    """
+    zigbee = FakeZigBee()
+    sched = scheduler.HealthScheduler(zigbee)
+    sched.add(GOOD, "supply_voltage", 0.01)
+    sched.remove(GOOD, "supply_voltage")
+    run(sched, 0.1)
+    assert zigbee.calls == []
+
+
+def test_unexpected_error_backs_off():
+    """
+    Should survive errors which aren't ZigBeeExceptions, report them and
+    back the node off.
+    """
+    zigbee = FakeZigBee()
+    results = []
+    sched = scheduler.HealthScheduler(
+        zigbee, callback=results.append, max_in_flight=1)
+    sched.add(BROKEN, "supply_voltage", 0.05)
+    sched.add(GOOD, "supply_voltage", 0.05)
+    sched.start()
+    try:
+        time.sleep(0.5)
+        assert all(x.is_alive() for x in sched._threads)
+    finally:
+        sched.stop()
+    broken = [x for x in results if x.dest_addr_long == BROKEN]
+    assert 1 <= len(broken) <= 3
+    assert all(isinstance(x.error, IOError) for x in broken)
+    assert len([x for x in results if x.dest_addr_long == GOOD]) >= 7
+
+
+def test_long_outage_backoff():
+    """
+    Should keep backing off at max_backoff however many times a node fails.
+    """
+    sched = scheduler.HealthScheduler(FakeZigBee(), max_backoff=60)
+    sched.add(BAD, "supply_voltage", 10)
+    job = sched._jobs[(BAD, "supply_voltage")]
+    sched._failures[BAD] = 5000
+    sched._reschedule(job, exceptions.ZigBeeTxFailure())
+    assert 59 < job.due - time.time() <= 60
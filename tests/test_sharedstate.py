@@ -0,0 +1,128 @@
+import os
+import subprocess
+import sys
+from datetime import timedelta
+
+import pytest
+
+from xbee_helper import const, sharedstate
+
+
+SOURCE = b"\x00\x13\xa2\x00\x40\x8b\x5c\x01"
+
+
+def test_publish_and_read(tmpdir):
+    """
+    Should let a separate read-only mapping see the latest published values.
+    """
+    path = str(tmpdir.join("table"))
+    writer = sharedstate.SharedStateTable(path, slots=4, create=True)
+    reader = sharedstate.SharedStateTable(path)
+    assert reader.get(SOURCE) is None
+    writer.update_sample(SOURCE, {"dio-0": True, "adc-3": 100})
+    writer.update_health(SOURCE, supply_voltage=3.3)
+    state = reader.get(SOURCE)
+    assert state.sample == {"dio-0": True, "adc-3": 100}
+    assert state.supply_voltage == 3.3
+    assert state.temperature is None
+
+
+def test_frame_received(tmpdir):
+    """
+    Should publish samples and health values from received frames.
+    """
+    table = sharedstate.SharedStateTable(
+        str(tmpdir.join("table")), slots=4, create=True)
+    table.frame_received(dict(
+        id="remote_at_response", source_addr_long=SOURCE, command=b"TP",
+        status=b"\x00", parameter=b"\x00\x19"))
+    table.frame_received(dict(
+        id="at_response", command=b"IS", status=b"\x00",
+        parameter=[{"dio-1": False}]))
+    assert table.get(SOURCE).temperature == 25
+    assert table.get().sample == {"dio-1": False}
+    assert len(list(table.nodes())) == 2
+
+
+def test_table_full(tmpdir):
+    """
+    Should refuse to publish more nodes than there are slots.
+    """
+    table = sharedstate.SharedStateTable(
+        str(tmpdir.join("table")), slots=1, create=True)
+    assert table.update_health(SOURCE, temperature=20)
+    assert not table.update_health(None, temperature=20)
+
+
+def node(number):
+    return SOURCE[:-1] + bytearray((number,))
+
+
+def test_recreate_in_place(tmpdir):
+    """
+    Should empty an existing table without shrinking the file under readers
+    which still have it mapped, and have them follow the new slot count.
+    """
+    path = str(tmpdir.join("table"))
+    writer = sharedstate.SharedStateTable(path, slots=4, create=True)
+    writer.update_health(SOURCE, temperature=20)
+    reader = sharedstate.SharedStateTable(path)
+    size = os.path.getsize(path)
+    writer.close()
+    writer = sharedstate.SharedStateTable(path, slots=2, create=True)
+    assert os.path.getsize(path) == size
+    assert reader.get(SOURCE) is None
+    assert list(reader.nodes()) == []
+    # These hash to slots 2 and 3 of the old table, so are only found by
+    # probing with the new slot count.
+    for number in range(2, 4):
+        assert writer.update_health(node(number), temperature=number)
+    for number in range(2, 4):
+        assert reader.get(node(number)).temperature == number
+    assert len(list(reader.nodes())) == 2
+
+
+def test_recreate_larger(tmpdir):
+    """
+    Should let readers see every slot of a table re-created with more of
+    them than when they mapped it.
+    """
+    path = str(tmpdir.join("table"))
+    sharedstate.SharedStateTable(path, slots=2, create=True).close()
+    reader = sharedstate.SharedStateTable(path)
+    writer = sharedstate.SharedStateTable(path, slots=8, create=True)
+    for number in range(8):
+        assert writer.update_health(node(number), temperature=number)
+    for number in range(8):
+        assert reader.get(node(number)).temperature == number
+    assert len(list(reader.nodes())) == 8
+
+
+@pytest.mark.skipif(
+    sys.version_info < (3, 7), reason="xbee_helper imports ZigBee eagerly")
+def test_reader_does_not_import_xbee():
+    """
+    Should be importable by readers without pulling in the xbee package.
+    """
+    subprocess.check_call([
+        sys.executable, "-c",
+        "import sys, xbee_helper.sharedstate; "
+        "assert 'xbee' not in sys.modules"])
+
+
+def test_read_timeout(tmpdir, monkeypatch):
+    """
+    Should give up on a slot left mid-update by a writer which died, until
+    the table is recreated.
+    """
+    monkeypatch.setattr(
+        const, "SHARED_STATE_READ_TIMEOUT", timedelta(seconds=0.05))
+    path = str(tmpdir.join("table"))
+    writer = sharedstate.SharedStateTable(path, slots=1, create=True)
+    sharedstate.SEQ.pack_into(writer._buf, writer._offset(0), 1)
+    writer.close()
+    reader = sharedstate.SharedStateTable(path)
+    with pytest.raises(IOError):
+        reader.get(SOURCE)
+    sharedstate.SharedStateTable(path, slots=1, create=True)
+    assert reader.get(SOURCE) is None
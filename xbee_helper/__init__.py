@@ -3,5 +3,21 @@ xbee_helper
 
 Allows 'from xbee_helper import ZigBee'.
 """
-from xbee_helper.device import ZigBee
+from sys import version_info
+
 __all__ = ("ZigBee",)
+
+if version_info >= (3, 7):
+    def __getattr__(name):
+        """
+        Import ZigBee (and with it the xbee package) only when it's first
+        used, so that the command line tool starts quickly. Module level
+        __getattr__ needs Python 3.7, so older versions import it eagerly.
+        """
+        if name == "ZigBee":
+            from xbee_helper import device
+            return device.ZigBee
+        raise AttributeError(
+            "module %r has no attribute %r" % (__name__, name))
+else:
+    from xbee_helper.device import ZigBee
@@ -0,0 +1,87 @@
+"""
+xbee_helper.cancellation
+
+Deadlines and cancellation tokens accepted by the request methods of ZigBee.
+"""
+import threading
+from datetime import datetime, timedelta
+
+from xbee_helper import const
+
+
+def resolve_deadline(deadline=None):
+    """
+    Turn a deadline given as a datetime, a timedelta from now or None (meaning
+    const.RX_TIMEOUT from now) into a datetime.
+    """
+    if deadline is None:
+        return datetime.now() + const.RX_TIMEOUT
+    if isinstance(deadline, timedelta):
+        return datetime.now() + deadline
+    return deadline
+
+
+def seconds_until(deadline):
+    """
+    Seconds from now until a datetime, or 0 if it has passed.
+    """
+    return max((deadline - datetime.now()).total_seconds(), 0)
+
+
+class CancelToken(object):
+    """
+    Passed to one or more requests so that they can be abandoned from another
+    thread by calling `cancel`. Once cancelled, a token stays cancelled.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        """
+        Whether `cancel` has been called.
+        """
+        return self._event.is_set()
+
+    def cancel(self):
+        """
+        Cancel every request using this token.
+        """
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def wait(self, timeout=None):
+        """
+        Wait until the token is cancelled or the timeout (in seconds) passes.
+        Returns whether it was cancelled.
+        """
+        return self._event.wait(timeout)
+
+    def add_callback(self, callback):
+        """
+        Adds a function to be called with no arguments when the token is
+        cancelled. If it already has been, the function is called straight
+        away.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        """
+        Removes a function added with add_callback, if it hasn't been called.
+        """
+        with self._lock:
+            try:
+                self._callbacks.remove(callback)
+            except ValueError:
+                pass
@@ -0,0 +1,323 @@
+"""
+xbee_helper.capture
+
+Records the raw byte stream between ZigBee and its serial port, and replays
+such a capture in place of a real serial port for load testing.
+
+A capture file starts with MAGIC and the capture start time, followed by
+records of CHUNK (microseconds since the start, direction and length) and
+then that many bytes.
+"""
+import heapq
+import logging
+import struct
+import threading
+import time
+from collections import defaultdict, deque
+
+
+_LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"XBCAP\x01\x00\x00"
+START = struct.Struct("<d")
+CHUNK = struct.Struct("<QBH")
+FROM_RADIO = 0
+TO_RADIO = 1
+
+START_BYTE = 0x7E
+# API frame types whose second byte is a frame ID which the response echoes.
+REQUEST_TYPES = (0x08, 0x09, 0x10, 0x11, 0x17)
+RESPONSE_TYPES = (0x88, 0x8B, 0x97)
+
+
+def checksum(data):
+    """
+    Calculate the checksum of a frame's data.
+    """
+    return 0xFF - (sum(bytearray(data)) & 0xFF)
+
+
+def build_frame(data):
+    """
+    Wrap frame data with the start byte, length and checksum.
+    """
+    data = bytearray(data)
+    return bytes(
+        bytearray((START_BYTE, len(data) >> 8, len(data) & 0xFF)) + data +
+        bytearray((checksum(data),)))
+
+
+def read_capture(fobj):
+    """
+    Yield (seconds since the start of capture, direction, bytes) for each
+    chunk in a capture file object.
+    """
+    if fobj.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a serial capture file.")
+    fobj.read(START.size)
+    while True:
+        header = fobj.read(CHUNK.size)
+        if len(header) < CHUNK.size:
+            return
+        offset, direction, length = CHUNK.unpack(header)
+        data = fobj.read(length)
+        if len(data) < length:
+            return
+        yield offset / 1000000.0, direction, data
+
+
+class FrameSplitter(object):
+    """
+    Reassembles API frames (in unescaped API mode) from a stream of chunks,
+    discarding anything which isn't a valid frame.
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """
+        Add bytes to the stream and return the data of every frame completed
+        by them.
+        """
+        self._buffer.extend(bytearray(data))
+        frames = []
+        while True:
+            # Search for a bytearray rather than the int, which Python 2's
+            # bytearray.find doesn't accept.
+            start = self._buffer.find(bytearray((START_BYTE,)))
+            if start < 0:
+                del self._buffer[:]
+                return frames
+            del self._buffer[:start]
+            if len(self._buffer) < 3:
+                return frames
+            length = (self._buffer[1] << 8) | self._buffer[2]
+            if len(self._buffer) < length + 4:
+                return frames
+            data = self._buffer[3:3 + length]
+            if checksum(data) == self._buffer[3 + length]:
+                frames.append(bytes(data))
+                del self._buffer[:length + 4]
+            else:
+                del self._buffer[:1]
+
+
+class CaptureSerial(object):
+    """
+    Wraps a serial port, recording everything read from and written to it in
+    the capture file at `path`. Pass it to ZigBee in place of the port.
+    """
+    def __init__(self, ser, path):
+        self._ser = ser
+        self._file = open(path, "wb")
+        self._start = time.time()
+        self._file.write(MAGIC + START.pack(self._start))
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._ser, name)
+
+    @property
+    def baudrate(self):
+        """
+        Baud rate of the wrapped port.
+        """
+        return self._ser.baudrate
+
+    @baudrate.setter
+    def baudrate(self, value):
+        self._ser.baudrate = value
+
+    def _record(self, direction, data):
+        offset = int((time.time() - self._start) * 1000000)
+        with self._lock:
+            for i in range(0, len(data), 0xFFFF):
+                chunk = data[i:i + 0xFFFF]
+                self._file.write(
+                    CHUNK.pack(offset, direction, len(chunk)) + bytes(chunk))
+            self._file.flush()
+
+    def inWaiting(self):  # pylint: disable=invalid-name
+        """
+        Move whatever the port has waiting into our buffer as one chunk, so
+        that the frame reader's byte by byte reads aren't recorded singly.
+        """
+        waiting = self._ser.inWaiting()
+        if waiting:
+            data = self._ser.read(waiting)
+            self._record(FROM_RADIO, data)
+            self._buffer.extend(bytearray(data))
+        return len(self._buffer)
+
+    def read(self, size=1):
+        """
+        Read from our buffer, falling back to the port if it's empty.
+        """
+        if not self._buffer:
+            data = self._ser.read(size)
+            if data:
+                self._record(FROM_RADIO, data)
+            return data
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def write(self, data):
+        """
+        Record and write data to the port.
+        """
+        self._record(TO_RADIO, data)
+        return self._ser.write(data)
+
+    def close(self):
+        """
+        Close the capture file and the port.
+        """
+        with self._lock:
+            self._file.close()
+        self._ser.close()
+
+
+class ReplaySerial(object):
+    """
+    Serial port stand-in which plays back a capture to ZigBee.
+
+    Frames the radio sent unprompted (IO samples, received data etc.) are
+    delivered at their recorded times divided by `speed`, or as fast as they
+    can be read if `speed` is None. Requests written to it are matched to a
+    recorded request of the same content (ignoring the frame ID), and every
+    response recorded for that (an ND command has several) is returned after
+    its recorded latency with the new frame ID substituted. Requests with no
+    recording go unanswered.
+    """
+    # Recorded, scheduled and buffered frames each need their own structure.
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, path, speed=1.0):
+        self._speed = speed
+        self._timeline = deque()
+        self._responses = defaultdict(deque)
+        self._load(path)
+        self._scheduled = []
+        self._sequence = 0
+        self._buffer = bytearray()
+        self._splitter = FrameSplitter()
+        self._lock = threading.Lock()
+        self._start = time.time()
+
+    @staticmethod
+    def _request_key(data):
+        return bytes(data[:1]) + bytes(data[2:])
+
+    def _load(self, path):
+        """
+        Split a capture into the unsolicited frame timeline and the recorded
+        responses to each request. A request's responses are those carrying
+        its frame ID until that ID is used again. Responses which match no
+        request are dropped, since replaying them with a stale frame ID would
+        answer whichever live request happened to hold it.
+        """
+        splitters = {FROM_RADIO: FrameSplitter(), TO_RADIO: FrameSplitter()}
+        outstanding = {}
+        with open(path, "rb") as fobj:
+            for offset, direction, chunk in read_capture(fobj):
+                for data in splitters[direction].feed(chunk):
+                    frame_type = bytearray(data[:1])[0]
+                    frame_id = data[1:2]
+                    if direction == TO_RADIO:
+                        if frame_type in REQUEST_TYPES and frame_id != b"\x00":
+                            recording = []
+                            self._responses[self._request_key(data)].append(
+                                recording)
+                            outstanding[frame_id] = (recording, offset)
+                    elif frame_type in RESPONSE_TYPES:
+                        if frame_id not in outstanding:
+                            _LOGGER.debug(
+                                "Dropping response to no request: %r", data)
+                            continue
+                        recording, sent = outstanding[frame_id]
+                        recording.append((offset - sent, data))
+                    else:
+                        self._timeline.append((offset, data))
+
+    def _due(self, offset):
+        if not self._speed:
+            return self._start
+        return self._start + offset / float(self._speed)
+
+    def _release(self):
+        """
+        Move every frame whose time has come into the read buffer.
+        """
+        now = time.time()
+        with self._lock:
+            while self._timeline and self._due(self._timeline[0][0]) <= now:
+                self._buffer.extend(bytearray(
+                    build_frame(self._timeline.popleft()[1])))
+            while self._scheduled and self._scheduled[0][0] <= now:
+                self._buffer.extend(bytearray(
+                    heapq.heappop(self._scheduled)[2]))
+
+    @property
+    def finished(self):
+        """
+        Whether every unsolicited frame has been played back and read.
+        """
+        self._release()
+        return not self._timeline and not self._buffer
+
+    def inWaiting(self):  # pylint: disable=invalid-name
+        """
+        Number of bytes available to read.
+        """
+        self._release()
+        return len(self._buffer)
+
+    @property
+    def in_waiting(self):
+        """
+        Number of bytes available to read (pyserial 3 name).
+        """
+        return self.inWaiting()
+
+    def read(self, size=1):
+        """
+        Read up to `size` bytes that are available now, without blocking.
+        """
+        self._release()
+        with self._lock:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        return data
+
+    def write(self, data):
+        """
+        Schedule the recorded responses to any complete requests written.
+        """
+        for request in self._splitter.feed(data):
+            recordings = self._responses.get(self._request_key(request))
+            if not recordings:
+                _LOGGER.debug("No recorded response to frame: %r", request)
+                continue
+            # Cycle through the recordings so repeated requests vary.
+            recording = recordings[0]
+            recordings.rotate(-1)
+            now = time.time()
+            for latency, response in recording:
+                response = bytearray(response)
+                response[1:2] = bytearray(request[1:2])
+                due = now
+                if self._speed:
+                    due += latency / float(self._speed)
+                with self._lock:
+                    self._sequence += 1
+                    heapq.heappush(self._scheduled, (
+                        due, self._sequence, build_frame(response)))
+        return len(data)
+
+    def close(self):
+        """
+        Nothing to close; present for compatibility with serial ports.
+        """
+        pass
@@ -0,0 +1,307 @@
+"""
+xbee_helper.cli
+
+The xbee-helper command. Results are written to stdout as one JSON object per
+line as soon as each request completes.
+
+The serial and xbee packages are only imported once a command opens the port,
+so that --help and argument errors return straight away. That needs Python 3.7
+or later; before then, importing any xbee_helper module imports xbee too.
+"""
+import argparse
+import binascii
+import json
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from xbee_helper import cancellation
+from xbee_helper import const
+from xbee_helper.scheduler import METRICS
+
+
+def address(value):
+    """
+    Parse a 64 bit address given as 16 hex digits (colons allowed).
+    """
+    digits = value.replace(":", "").strip()
+    try:
+        addr = binascii.unhexlify(digits)
+    except (TypeError, ValueError):
+        addr = b""
+    if len(addr) != 8:
+        raise argparse.ArgumentTypeError(
+            "%r is not a 64 bit address in hex." % value)
+    return addr
+
+
+def metric_list(value):
+    """
+    Parse a comma separated list of metric names.
+    """
+    metrics = [x.strip() for x in value.split(",") if x.strip()]
+    unknown = [x for x in metrics if x not in METRICS]
+    if unknown or not metrics:
+        raise argparse.ArgumentTypeError(
+            "Unknown metric(s) %s. Choose from %s." % (
+                ", ".join(unknown), ", ".join(sorted(METRICS))))
+    return metrics
+
+
+def jsonable(value):
+    """
+    Convert values returned by ZigBee methods into something json can encode.
+    """
+    if isinstance(value, bytes):
+        try:
+            return value.decode("ascii")
+        except UnicodeDecodeError:
+            return binascii.hexlify(value).decode("ascii")
+    if isinstance(value, dict):
+        return {k: jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [jsonable(x) for x in value]
+    return value
+
+
+def hex_address(addr):
+    """
+    Format a 64 bit address as hex, or None for the local device.
+    """
+    if addr is None:
+        return None
+    return binascii.hexlify(addr).decode("ascii")
+
+
+class Output(object):
+    """
+    Writes newline delimited JSON to a stream from any thread.
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, stream):
+        self._stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, **record):
+        """
+        Write one record and flush it straight out.
+        """
+        line = json.dumps(jsonable(record), sort_keys=True)
+        with self._lock:
+            self._stream.write(line + "\n")
+            self._stream.flush()
+
+
+def run_window(jobs, window):
+    """
+    Call each of `jobs` with at most `window` running at once.
+    """
+    jobs = list(jobs)
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not jobs:
+                    return
+                job = jobs.pop(0)
+            job()
+
+    threads = [
+        threading.Thread(target=worker) for _ in range(min(window, len(jobs)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        # Join with a timeout so that Ctrl-C is still delivered.
+        while thread.is_alive():
+            thread.join(0.1)
+
+
+def request_job(zigbee, output, dest_addr_long, metric, args):
+    """
+    Return a job which makes one request and emits its result or error. The
+    request gets --timeout seconds, cut short by the command's overall
+    --deadline if there is one.
+    """
+    def job():
+        record = dict(node=hex_address(dest_addr_long), metric=metric)
+        deadline = datetime.now() + timedelta(seconds=args.timeout)
+        if args.deadline_at is not None:
+            deadline = min(deadline, args.deadline_at)
+        try:
+            record["value"] = getattr(zigbee, METRICS[metric])(
+                dest_addr_long=dest_addr_long, deadline=deadline,
+                cancel=args.cancel)
+        except Exception as exc:  # pylint: disable=broad-except
+            # Serial errors, malformed frames etc. still get a record, and
+            # mustn't kill the worker running the job.
+            record["error"] = exc.__class__.__name__
+            record["message"] = str(exc)
+        output.emit(**record)
+    return job
+
+
+def sweep(zigbee, args, output):
+    """
+    Fetch the requested metrics from every node.
+    """
+    run_window((
+        request_job(zigbee, output, addr, metric, args)
+        for addr in args.nodes for metric in args.metrics), args.window)
+
+
+def sample(zigbee, args, output):
+    """
+    Take an IO sample from every node.
+    """
+    run_window((
+        request_job(zigbee, output, addr, "sample", args)
+        for addr in args.nodes), args.window)
+
+
+def watch(zigbee, args, output):
+    """
+    Emit every IO sample frame pushed by the network until interrupted,
+    optionally polling the given nodes for samples every --interval seconds.
+    """
+    def frame_received(frame):
+        if frame.get("id") != "rx_io_data_long_addr":
+            return
+        for io_sample in frame.get("samples", []):
+            output.emit(
+                node=hex_address(frame.get("source_addr_long")),
+                metric="sample", value=io_sample, timestamp=time.time())
+
+    zigbee.add_frame_rx_handler(frame_received)
+    scheduler = None
+    if args.nodes and args.interval:
+        scheduler = zigbee.create_health_scheduler(
+            max_in_flight=args.window, timeout=args.timeout,
+            callback=lambda result: output.emit(
+                node=hex_address(result.dest_addr_long),
+                metric=result.metric, value=result.value,
+                error=result.error and result.error.__class__.__name__,
+                timestamp=result.timestamp))
+        for addr in args.nodes:
+            scheduler.add(addr, "sample", args.interval)
+        scheduler.start()
+    try:
+        while True:
+            time.sleep(1)
+    finally:
+        if scheduler is not None:
+            scheduler.stop()
+        zigbee.remove_frame_rx_handler(frame_received)
+
+
+def read_nodes(args):
+    """
+    Combine the addresses given as arguments with any read from --nodes-file.
+    """
+    nodes = list(args.nodes)
+    if args.nodes_file is not None:
+        for line in args.nodes_file:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                nodes.append(address(line))
+    return nodes
+
+
+def build_parser():
+    """
+    Build the argument parser for the xbee-helper command.
+    """
+    parser = argparse.ArgumentParser(
+        prog="xbee-helper",
+        description="Query XBee ZigBee devices and stream the results as "
+                    "newline delimited JSON.")
+    parser.add_argument(
+        "-p", "--port", default="/dev/ttyUSB0",
+        help="Serial port of the local device (default: %(default)s).")
+    parser.add_argument(
+        "-b", "--baudrate", type=int, default=9600,
+        help="Serial baud rate (default: %(default)s).")
+    parser.add_argument(
+        "-w", "--window", type=int, default=4,
+        help="Maximum requests in flight at once (default: %(default)s).")
+    parser.add_argument(
+        "-t", "--timeout", type=float,
+        default=const.RX_TIMEOUT.total_seconds(),
+        help="Seconds to wait for each response (default: %(default)s).")
+    parser.add_argument(
+        "-d", "--deadline", type=float,
+        help="Seconds allowed for the whole of a sweep or sample, after "
+             "which outstanding requests fail.")
+    parser.add_argument(
+        "-f", "--nodes-file", type=argparse.FileType("r"),
+        help="File of node addresses, one per line ('-' for stdin).")
+    parser.set_defaults(deadline_at=None, cancel=None)
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    sweep_parser = subparsers.add_parser(
+        "sweep", help="Fetch health metrics from each node.")
+    sweep_parser.add_argument(
+        "-m", "--metrics", type=metric_list,
+        default=["supply_voltage", "temperature"],
+        help="Comma separated metrics from: %s (default: "
+             "supply_voltage,temperature)." % ", ".join(sorted(METRICS)))
+    sweep_parser.set_defaults(func=sweep)
+
+    sample_parser = subparsers.add_parser(
+        "sample", help="Take an IO sample from each node.")
+    sample_parser.set_defaults(func=sample)
+
+    watch_parser = subparsers.add_parser(
+        "watch", help="Stream IO samples pushed by the network.")
+    watch_parser.add_argument(
+        "-i", "--interval", type=float,
+        help="Also poll each node for a sample every INTERVAL seconds.")
+    watch_parser.set_defaults(func=watch)
+
+    for subparser in (sweep_parser, sample_parser, watch_parser):
+        subparser.add_argument(
+            "nodes", nargs="*", type=address, metavar="NODE",
+            help="64 bit node address in hex.")
+    return parser
+
+
+def main(argv=None):
+    """
+    Entry point for the xbee-helper command.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        args.nodes = read_nodes(args)
+    except argparse.ArgumentTypeError as exc:
+        parser.error(str(exc))
+    if args.command in ("sweep", "sample") and not args.nodes:
+        parser.error("At least one node address is required.")
+    if args.window < 1:
+        parser.error("--window must be at least 1.")
+    if args.deadline is not None:
+        args.deadline_at = datetime.now() + timedelta(seconds=args.deadline)
+    args.cancel = cancellation.CancelToken()
+
+    # Deferred so that everything above stays fast.
+    import serial
+    from xbee_helper.device import ZigBee
+
+    ser = serial.Serial(args.port, args.baudrate)
+    zigbee = ZigBee(ser)
+    try:
+        args.func(zigbee, args, Output(sys.stdout))
+    except KeyboardInterrupt:
+        # Abandon anything still in flight rather than waiting it out.
+        args.cancel.cancel()
+    finally:
+        zigbee.zb.halt()
+        ser.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
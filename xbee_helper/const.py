@@ -29,6 +29,51 @@ ADC_PERCENTAGE = 1
 ADC_VOLTS = 2
 ADC_MILLIVOLTS = 3
 
+# Standard serial rates selectable with the BD command, keyed by BD value.
+BAUD_RATES = {
+    0: 1200,
+    1: 2400,
+    2: 4800,
+    3: 9600,
+    4: 19200,
+    5: 38400,
+    6: 57600,
+    7: 115200
+}
+
+# Number of application data frames allowed in flight awaiting tx_status.
+TX_WINDOW = 4
+TX_RETRIES = 0
+# Number of records written to a sample log segment before starting another.
+SAMPLE_LOG_SEGMENT_RECORDS = 1 << 16
+# Defaults for the health scheduler.
+SCHEDULER_MAX_IN_FLIGHT = 2
+SCHEDULER_JITTER = 0.1
+SCHEDULER_MAX_BACKOFF = timedelta(minutes=15)
+# Backing file and capacity of the shared latest value table.
+SHARED_STATE_PATH = "/dev/shm/xbee-helper"
+SHARED_STATE_SLOTS = 256
+# How long a reader waits for a slot whose writer is mid-update.
+SHARED_STATE_READ_TIMEOUT = timedelta(seconds=1)
+# Delivery status byte of a tx_status (0x8B) frame and its meaning.
+TX_DELIVERY_STATUSES = {
+    b"\x01": "MAC ACK failure",
+    b"\x02": "CCA failure",
+    b"\x15": "Invalid destination endpoint",
+    b"\x21": "Network ACK failure",
+    b"\x22": "Not joined to network",
+    b"\x23": "Self-addressed",
+    b"\x24": "Address not found",
+    b"\x25": "Route not found",
+    b"\x26": "Broadcast source failed to hear a neighbor relay the message",
+    b"\x2B": "Invalid binding table index",
+    b"\x2C": "Resource error (lack of free buffers, timers etc.)",
+    b"\x2D": "Attempted broadcast with APS transmission",
+    b"\x2E": "Attempted unicast with APS transmission, but EE=0",
+    b"\x32": "Resource error (lack of free buffers, timers etc.)",
+    b"\x74": "Data payload too large"
+}
+
 
 class GPIOSetting(object):
     """
@@ -0,0 +1,23 @@
+"""
+xbee_helper.convert
+
+Conversions of raw parameter values. Kept apart from xbee_helper.device so
+that modules which only read published data don't import the xbee package.
+"""
+from sys import version_info
+
+
+def hex_to_int(value):
+    """
+    Convert hex string like "\x0A\xE3" to 2787.
+    """
+    if version_info.major >= 3:
+        return int.from_bytes(value, "big")
+    return int(value.encode("hex"), 16)
+
+
+def supply_voltage_to_volts(value):
+    """
+    Convert the raw %V parameter to Volts.
+    """
+    return (hex_to_int(value) * (1200/1024.0)) / 1000
@@ -5,14 +5,17 @@ Provides the main ZigBee class of the project and contains various constants
 and utility functions to support it.
 """
 import logging
+import threading
 from datetime import datetime
-from time import sleep
-from sys import version_info
 
 from xbee import ZigBee as ZigBeeDevice
 
 from xbee_helper import exceptions
 from xbee_helper import const
+from xbee_helper import cancellation
+from xbee_helper import scheduler
+from xbee_helper import transmit
+from xbee_helper.convert import hex_to_int, supply_voltage_to_volts
 
 
 _LOGGER = logging.getLogger(__name__)
@@ -39,13 +42,17 @@ def raise_if_error(frame):
     raise exceptions.ZigBeeUnknownStatus()
 
 
-def hex_to_int(value):
+def raise_if_tx_error(frame):
     """
-    Convert hex string like "\x0A\xE3" to 2787.
+    Checks a tx_status frame and raises the relevant exception if its payload
+    was not delivered.
     """
-    if version_info.major >= 3:
-        return int.from_bytes(value, "big")
-    return int(value.encode("hex"), 16)
+    status = frame.get("deliver_status", b"\x00")
+    if status == b"\x00":
+        return
+    if status in const.TX_DELIVERY_STATUSES:
+        raise exceptions.ZigBeeTxFailure(const.TX_DELIVERY_STATUSES[status])
+    raise exceptions.ZigBeeUnknownStatus()
 
 
 def adc_to_percentage(value, max_volts, clamp=True):
@@ -90,13 +97,30 @@ class ZigBee(object):
     is used to send a remote AT command to a device on the ZigBee network. If
     the parameter is not provided, then an AT command will be sent to the
     local device on the serial port.
+
+    Every method which makes requests also takes optional `deadline` and
+    `cancel` parameters. `deadline` is a datetime, or a timedelta from now, by
+    which the response must arrive (const.RX_TIMEOUT from now if not given).
+    `cancel` is a CancelToken which abandons the request when cancelled. In
+    either case ZigBeeResponseTimeout or ZigBeeCancelled is raised, the frame
+    ID is released straight away and any late response is discarded.
     """
+    # Request, transmit window and reaper state all hang off the instance.
+    # pylint: disable=too-many-instance-attributes
     _rx_frames = {}
     _rx_handlers = []
     _frame_id = 1
 
-    def __init__(self, ser):
+    def __init__(self, ser, tx_window=const.TX_WINDOW):
         self._ser = ser
+        self._frame_id_lock = threading.RLock()
+        self._waiters = {}
+        self._abandoned = set()
+        self._tx_window = tx_window
+        self._tx_pending = {}
+        self._tx_cond = threading.Condition()
+        self._tx_reaper = None
+        self._max_payload = None
         # I think it's obvious that zb refers to a ZigBee.
         # pylint: disable=invalid-name
         self.zb = ZigBeeDevice(ser, callback=self._frame_received)
@@ -107,12 +131,20 @@ class ZigBee(object):
         Gets a byte of the next valid frame ID (1 - 255), increments the
         internal _frame_id counter and wraps it back to 1 if necessary.
         """
-        # Python 2/3 compatible way of converting 1 to "\x01" in py2 or b"\x01"
-        # in py3.
-        fid = bytes(bytearray((self._frame_id,)))
-        self._frame_id += 1
-        if self._frame_id > 0xFF:
-            self._frame_id = 1
+        with self._frame_id_lock:
+            for _ in range(0xFF):
+                # Python 2/3 compatible way of converting 1 to "\x01" in py2
+                # or b"\x01" in py3.
+                fid = bytes(bytearray((self._frame_id,)))
+                self._frame_id += 1
+                if self._frame_id > 0xFF:
+                    self._frame_id = 1
+                # Don't reuse the ID of a request still awaiting its response.
+                if fid not in self._waiters and fid not in self._tx_pending:
+                    break
+            else:
+                raise exceptions.ZigBeeFrameIdsExhausted()
+            self._abandoned.discard(fid)
         try:
             del self._rx_frames[fid]
         except KeyError:
@@ -121,18 +153,37 @@ class ZigBee(object):
 
     def _frame_received(self, frame):
         """
-        Put the frame into the _rx_frames dict with a key of the frame_id.
+        Put the frame into the _rx_frames dict with a key of the frame_id and
+        wake whoever is waiting for it, unless it's the tx_status of a frame
+        sent by send_data or the late response to an abandoned request.
         """
-        try:
-            self._rx_frames[frame["frame_id"]] = frame
-        except KeyError:
-            # Has no frame_id, ignore?
-            pass
+        if frame.get("id") != "tx_status" or not self._tx_status_received(
+                frame):
+            self._store_frame(frame)
         _LOGGER.debug("Frame received: %s", frame)
         # Give the frame to any interested functions
         for handler in self._rx_handlers:
             handler(frame)
 
+    def _store_frame(self, frame):
+        """
+        Stores a received frame by frame_id for _send_and_wait to collect.
+        """
+        try:
+            frame_id = frame["frame_id"]
+        except KeyError:
+            # Has no frame_id, ignore?
+            return
+        with self._frame_id_lock:
+            if frame_id in self._abandoned:
+                self._abandoned.discard(frame_id)
+                _LOGGER.debug("Discarding late response: %s", frame)
+                return
+            self._rx_frames[frame_id] = frame
+            waiter = self._waiters.get(frame_id)
+        if waiter is not None:
+            waiter.set()
+
     def _send(self, **kwargs):
         """
         Send a frame to either the local ZigBee or a remote device.
@@ -142,35 +193,370 @@ class ZigBee(object):
         else:
             self.zb.at(**kwargs)
 
-    def _send_and_wait(self, **kwargs):
+    def _send_and_wait(self, deadline=None, cancel=None, **kwargs):
         """
         Send a frame to either the local ZigBee or a remote device and wait
-        for a pre-defined amount of time for its response.
+        until the deadline for its response.
+        """
+        deadline = cancellation.resolve_deadline(deadline)
+        # Don't spend a frame ID or airtime on a request that's already over.
+        if cancel is not None and cancel.cancelled:
+            raise exceptions.ZigBeeCancelled()
+        if not cancellation.seconds_until(deadline):
+            raise exceptions.ZigBeeResponseTimeout()
+        waiter = threading.Event()
+        with self._frame_id_lock:
+            frame_id = self.next_frame_id
+            self._waiters[frame_id] = waiter
+        if cancel is not None:
+            cancel.add_callback(waiter.set)
+        answered = False
+        try:
+            kwargs.update(dict(frame_id=frame_id))
+            self._send(**kwargs)
+            while True:
+                frame = self._rx_frames.pop(frame_id, None)
+                if frame is not None:
+                    answered = True
+                    raise_if_error(frame)
+                    return frame
+                if cancel is not None and cancel.cancelled:
+                    raise exceptions.ZigBeeCancelled()
+                remaining = cancellation.seconds_until(deadline)
+                if not remaining:
+                    _LOGGER.error(
+                        "Did not receive response within the deadline.")
+                    raise exceptions.ZigBeeResponseTimeout()
+                waiter.wait(remaining)
+                waiter.clear()
+        finally:
+            if cancel is not None:
+                cancel.remove_callback(waiter.set)
+            with self._frame_id_lock:
+                del self._waiters[frame_id]
+                if not answered and self._rx_frames.pop(
+                        frame_id, None) is None:
+                    self._abandoned.add(frame_id)
+
+    def _track_tx(self, pending):
+        """
+        Allocates a frame ID for a fragment and records it as in flight. Must
+        be called with self._tx_cond held.
         """
         frame_id = self.next_frame_id
-        kwargs.update(dict(frame_id=frame_id))
-        self._send(**kwargs)
-        timeout = datetime.now() + const.RX_TIMEOUT
-        while datetime.now() < timeout:
+        pending.expires = datetime.now() + const.RX_TIMEOUT
+        if pending.deadline is not None:
+            pending.expires = min(pending.expires, pending.deadline)
+        self._tx_pending[frame_id] = pending
+        # Wake the reaper in case this expires before what it's waiting on.
+        self._tx_cond.notify_all()
+        if self._tx_reaper is None:
+            self._tx_reaper = threading.Thread(
+                target=self._reap_tx, name="ZigBeeTxReaper")
+            self._tx_reaper.daemon = True
+            self._tx_reaper.start()
+        return frame_id
+
+    def _reap_tx(self):
+        """
+        Fails fragments whose tx_status doesn't arrive before they expire.
+        Runs for as long as any fragments are in flight.
+        """
+        while True:
+            with self._tx_cond:
+                expired = self._expire_tx()
+                if not expired:
+                    if not self._tx_pending:
+                        self._tx_reaper = None
+                        return
+                    self._tx_cond.wait(cancellation.seconds_until(min(
+                        x.expires for x in self._tx_pending.values())))
+                    continue
+            for stale in expired:
+                stale.future.set_exception(
+                    exceptions.ZigBeeResponseTimeout())
+
+    def _untrack_tx(self, frame_id):
+        """
+        Stops tracking a fragment, discarding its tx_status if it turns up
+        later. Must be called with self._tx_cond held.
+        """
+        pending = self._tx_pending.pop(frame_id)
+        with self._frame_id_lock:
+            self._abandoned.add(frame_id)
+        self._tx_cond.notify_all()
+        return pending
+
+    def _write_tx(self, frame_id, pending):
+        """
+        Hands a tracked fragment to the radio, failing its transfer if the
+        frame can't be written.
+        """
+        try:
+            self.zb.tx(
+                frame_id=frame_id,
+                dest_addr_long=pending.dest_addr_long,
+                data=pending.data)
+        except Exception as exc:  # pylint: disable=broad-except
+            _LOGGER.exception("Unable to send data frame.")
+            with self._tx_cond:
+                if frame_id in self._tx_pending:
+                    self._untrack_tx(frame_id)
+            pending.future.set_exception(exc)
+
+    def _expire_tx(self):
+        """
+        Stops tracking fragments whose tx_status has not arrived within the
+        configured timeout or their transfer's deadline and returns them.
+        Must be called with self._tx_cond held.
+        """
+        now = datetime.now()
+        expired = [
+            fid for fid, pending in self._tx_pending.items()
+            if pending.expires <= now]
+        return [self._untrack_tx(fid) for fid in expired]
+
+    def _cancel_tx(self, future):
+        """
+        Stops tracking every fragment of a transfer and fails it with
+        ZigBeeCancelled, releasing its window slots straight away.
+        """
+        with self._tx_cond:
+            for fid in [
+                    fid for fid, pending in self._tx_pending.items()
+                    if pending.future is future]:
+                self._untrack_tx(fid)
+        future.set_exception(exceptions.ZigBeeCancelled())
+
+    def _acquire_tx_slot(self, pending):
+        """
+        Waits for room in the transmit window and tracks the fragment in it.
+        Returns its frame ID, or None if its transfer failed in the meantime.
+        """
+        while True:
+            with self._tx_cond:
+                expired = self._expire_tx()
+                if not expired:
+                    if pending.future.done():
+                        return None
+                    if len(self._tx_pending) < self._tx_window:
+                        return self._track_tx(pending)
+                    if pending.deadline is None or \
+                            datetime.now() < pending.deadline:
+                        self._tx_cond.wait(0.1)
+                        continue
+                    # Out of time before the fragment could even be sent.
+                    expired = [pending]
+            for stale in expired:
+                stale.future.set_exception(
+                    exceptions.ZigBeeResponseTimeout())
+
+    def _tx_status_received(self, frame):
+        """
+        Resolves or retransmits the fragment a tx_status frame refers to.
+        Returns False if the frame doesn't belong to a tracked fragment.
+        """
+        with self._tx_cond:
+            pending = self._tx_pending.pop(frame.get("frame_id"), None)
+            if pending is None:
+                return False
+            error = None
             try:
-                frame = self._rx_frames.pop(frame_id)
-                raise_if_error(frame)
-                return frame
-            except KeyError:
-                sleep(0.1)
-                continue
-        _LOGGER.exception(
-            "Did not receive response within configured timeout period.")
-        raise exceptions.ZigBeeResponseTimeout()
-
-    def _get_parameter(self, parameter, dest_addr_long=None):
+                raise_if_tx_error(frame)
+            except exceptions.ZigBeeException as exc:
+                error = exc
+            retry = (
+                isinstance(error, exceptions.ZigBeeTxFailure) and
+                pending.retries > 0 and not pending.future.done())
+            if retry:
+                # Reuse the window slot this fragment already held.
+                pending.retries -= 1
+                frame_id = self._track_tx(pending)
+            else:
+                self._tx_cond.notify_all()
+        if retry:
+            _LOGGER.debug(
+                "Retransmitting data frame after failure: %s", error)
+            self._write_tx(frame_id, pending)
+        elif error is None:
+            pending.future.fragment_delivered(frame)
+        else:
+            pending.future.set_exception(error)
+        return True
+
+    def _get_parameter(
+            self, parameter, dest_addr_long=None, deadline=None, cancel=None):
         """
         Fetches and returns the value of the specified parameter.
         """
         frame = self._send_and_wait(
-            command=parameter, dest_addr_long=dest_addr_long)
+            command=parameter, dest_addr_long=dest_addr_long,
+            deadline=deadline, cancel=cancel)
         return frame["parameter"]
 
+    def get_max_payload(self, deadline=None, cancel=None):
+        """
+        Fetches and returns the maximum number of RF payload bytes the local
+        device will accept in a single frame (NP). The value is cached.
+        """
+        if self._max_payload is None:
+            self._max_payload = hex_to_int(self._get_parameter(
+                b"NP", deadline=deadline, cancel=cancel))
+        return self._max_payload
+
+    def send_data(
+            self, dest_addr_long, payload, retries=const.TX_RETRIES,
+            deadline=None, cancel=None):
+        """
+        Sends an application payload to a remote device, splitting it into as
+        many frames as the maximum payload size (NP) requires.
+
+        Up to `tx_window` frames are kept in flight at once, so this only
+        blocks while the window is full. Each failed frame is retransmitted up
+        to `retries` times, which means fragments may arrive out of order.
+        Returns a TxFuture which resolves to the list of tx_status frames once
+        every fragment has been delivered.
+
+        If given, `deadline` bounds the whole transfer rather than each
+        fragment. Otherwise each fragment has const.RX_TIMEOUT to be
+        acknowledged.
+        """
+        if deadline is not None:
+            deadline = cancellation.resolve_deadline(deadline)
+        fragments = transmit.fragment(payload, self.get_max_payload(
+            deadline=deadline, cancel=cancel))
+        future = transmit.TxFuture(len(fragments))
+        if cancel is not None:
+            def on_cancel():
+                self._cancel_tx(future)
+            cancel.add_callback(on_cancel)
+            future.add_done_callback(
+                lambda _: cancel.remove_callback(on_cancel))
+        for data in fragments:
+            pending = transmit.PendingFragment(
+                future, dest_addr_long, data, retries, deadline)
+            frame_id = self._acquire_tx_slot(pending)
+            if frame_id is None:
+                break
+            self._write_tx(frame_id, pending)
+        return future
+
+    def _link_ok(self, bd_value, deadline=None, cancel=None):
+        """
+        Checks that a round trip to the local device works and that it
+        reports the expected BD value.
+        """
+        try:
+            return hex_to_int(self._get_parameter(
+                b"BD", deadline=deadline, cancel=cancel)) == bd_value
+        except exceptions.ZigBeeCancelled:
+            raise
+        except exceptions.ZigBeeException:
+            return False
+
+    def _set_baud_rate(self, bd_value, deadline=None, cancel=None):
+        """
+        Sets BD on the local device, which answers at its old rate, then
+        switches the serial port to match.
+        """
+        self._send_and_wait(
+            command=b"BD", parameter=bytes(bytearray((bd_value,))),
+            deadline=deadline, cancel=cancel)
+        self._ser.baudrate = const.BAUD_RATES[bd_value]
+
+    def upgrade_baud_rate(
+            self, max_baudrate=None, persist=False, deadline=None,
+            cancel=None):
+        """
+        Raises the local device and serial port to the highest standard baud
+        rate (up to max_baudrate) which the port supports, then verifies the
+        link with a round trip. If that fails, the original rate is restored.
+        The new rate is only written to non-volatile memory if persist is
+        True, so a power cycle otherwise undoes it. Returns the baud rate in
+        use afterwards.
+
+        If given, `deadline` bounds the whole upgrade rather than each of its
+        round trips. Otherwise each has const.RX_TIMEOUT to be answered. If
+        the deadline passes or `cancel` is cancelled once the device has been
+        told to switch, the original rate is still restored (with
+        const.RX_TIMEOUT for each round trip) before ZigBeeResponseTimeout or
+        ZigBeeCancelled is raised, so that both ends agree.
+
+        Intended to be called once at startup, before other requests are made.
+        """
+        if deadline is not None:
+            deadline = cancellation.resolve_deadline(deadline)
+
+        def step():
+            step_deadline = cancellation.resolve_deadline()
+            if deadline is not None:
+                step_deadline = min(step_deadline, deadline)
+            return dict(deadline=step_deadline, cancel=cancel)
+
+        original = hex_to_int(self._get_parameter(b"BD", **step()))
+        host_rates = getattr(
+            self._ser, "BAUDRATES", const.BAUD_RATES.values())
+        candidates = [
+            value for value, rate in const.BAUD_RATES.items()
+            if rate in host_rates and (
+                max_baudrate is None or rate <= max_baudrate)]
+        if not candidates or original not in const.BAUD_RATES or max(
+                candidates) <= original:
+            return self._ser.baudrate
+        target = max(candidates)
+        try:
+            self._set_baud_rate(target, **step())
+            linked = self._link_ok(target, **step())
+        except exceptions.ZigBeeException:
+            # The device may have switched even though its answer was lost
+            # or we stopped waiting for it.
+            linked = False
+        if linked:
+            if persist:
+                self._send_and_wait(command=b"WR", **step())
+            return self._ser.baudrate
+        _LOGGER.warning(
+            "Link failed at %s baud, falling back to %s baud.",
+            const.BAUD_RATES[target], const.BAUD_RATES[original])
+        self._restore_baud_rate(original, target)
+        if cancel is not None and cancel.cancelled:
+            raise exceptions.ZigBeeCancelled()
+        if deadline is not None and not cancellation.seconds_until(deadline):
+            raise exceptions.ZigBeeResponseTimeout()
+        return self._ser.baudrate
+
+    def _restore_baud_rate(self, original, target):
+        """
+        Gets both ends back to the original BD value after a failed switch
+        to the target one, whether or not the device made the switch. This
+        ignores the upgrade's deadline and cancellation, since stopping part
+        way would leave the device unreachable.
+        """
+        # The device may not have switched at all.
+        self._ser.baudrate = const.BAUD_RATES[original]
+        if self._link_ok(original):
+            return
+        # It switched but the link doesn't work at the new rate, so try to
+        # tell it to switch back.
+        self._ser.baudrate = const.BAUD_RATES[target]
+        try:
+            self._set_baud_rate(original)
+        except exceptions.ZigBeeException:
+            self._ser.baudrate = const.BAUD_RATES[original]
+        if self._link_ok(original):
+            return
+        raise exceptions.ZigBeeBaudRateError(
+            "Unable to communicate with the device at %s or %s baud." % (
+                const.BAUD_RATES[target], const.BAUD_RATES[original]))
+
+    def create_health_scheduler(self, **kwargs):
+        """
+        Returns a HealthScheduler which polls metrics from devices through
+        this ZigBee. Keyword arguments are passed on to
+        xbee_helper.scheduler.HealthScheduler.
+        """
+        return scheduler.HealthScheduler(self, **kwargs)
+
     def add_frame_rx_handler(self, handler):
         """
         Adds a function to the list of functions which will be called when a
@@ -185,23 +571,27 @@ class ZigBee(object):
         """
         self._rx_handlers.remove(handler)
 
-    def get_sample(self, dest_addr_long=None):
+    def get_sample(self, dest_addr_long=None, deadline=None, cancel=None):
         """
         Initiate a sample and return its data.
         """
         frame = self._send_and_wait(
-            command=b"IS", dest_addr_long=dest_addr_long)
+            command=b"IS", dest_addr_long=dest_addr_long,
+            deadline=deadline, cancel=cancel)
         if "parameter" in frame:
             # @TODO: Is there always one value? Is it always a list?
             return frame["parameter"][0]
         return {}
 
-    def read_digital_pin(self, pin_number, dest_addr_long=None):
+    def read_digital_pin(
+            self, pin_number, dest_addr_long=None, deadline=None,
+            cancel=None):
         """
         Fetches a sample and returns the boolean value of the requested digital
         pin.
         """
-        sample = self.get_sample(dest_addr_long=dest_addr_long)
+        sample = self.get_sample(
+            dest_addr_long=dest_addr_long, deadline=deadline, cancel=cancel)
         try:
             return sample[const.DIGITAL_PINS[pin_number]]
         except KeyError:
@@ -209,9 +599,11 @@ class ZigBee(object):
                 "Pin %s (%s) is not configured as a digital input or output."
                 % (pin_number, const.IO_PIN_COMMANDS[pin_number]))
 
-    def read_analog_pin(
+    # deadline and cancel are taken by every request method.
+    def read_analog_pin(  # pylint: disable=too-many-arguments
             self, pin_number, adc_max_volts,
-            dest_addr_long=None, output_type=const.ADC_RAW):
+            dest_addr_long=None, output_type=const.ADC_RAW, deadline=None,
+            cancel=None):
         """
         Fetches a sample and returns the integer value of the requested analog
         pin. output_type should be one of the following constants from
@@ -222,7 +614,8 @@ class ZigBee(object):
         - ADC_VOLTS
         - ADC_MILLIVOLTS
         """
-        sample = self.get_sample(dest_addr_long=dest_addr_long)
+        sample = self.get_sample(
+            dest_addr_long=dest_addr_long, deadline=deadline, cancel=cancel)
         try:
             return convert_adc(
                 sample[const.ANALOG_PINS[pin_number]],
@@ -234,7 +627,9 @@ class ZigBee(object):
                 "Pin %s (%s) is not configured as an analog input." % (
                     pin_number, const.IO_PIN_COMMANDS[pin_number]))
 
-    def set_gpio_pin(self, pin_number, setting, dest_addr_long=None):
+    def set_gpio_pin(
+            self, pin_number, setting, dest_addr_long=None, deadline=None,
+            cancel=None):
         """
         Set a gpio pin setting.
         """
@@ -242,43 +637,57 @@ class ZigBee(object):
         self._send_and_wait(
             command=const.IO_PIN_COMMANDS[pin_number],
             parameter=setting.value,
-            dest_addr_long=dest_addr_long)
+            dest_addr_long=dest_addr_long,
+            deadline=deadline,
+            cancel=cancel)
 
-    def get_gpio_pin(self, pin_number, dest_addr_long=None):
+    def get_gpio_pin(
+            self, pin_number, dest_addr_long=None, deadline=None,
+            cancel=None):
         """
         Get a gpio pin setting.
         """
         frame = self._send_and_wait(
             command=const.IO_PIN_COMMANDS[pin_number],
-            dest_addr_long=dest_addr_long
+            dest_addr_long=dest_addr_long,
+            deadline=deadline,
+            cancel=cancel
         )
         value = frame["parameter"]
         return const.GPIO_SETTINGS[value]
 
-    def get_supply_voltage(self, dest_addr_long=None):
+    def get_supply_voltage(
+            self, dest_addr_long=None, deadline=None, cancel=None):
         """
         Fetches the value of %V and returns it as volts.
         """
-        value = self._get_parameter(b"%V", dest_addr_long=dest_addr_long)
-        return (hex_to_int(value) * (1200/1024.0)) / 1000
+        return supply_voltage_to_volts(self._get_parameter(
+            b"%V", dest_addr_long=dest_addr_long, deadline=deadline,
+            cancel=cancel))
 
-    def get_node_name(self, dest_addr_long=None):
+    def get_node_name(self, dest_addr_long=None, deadline=None, cancel=None):
         """
         Fetches and returns the value of NI.
         """
-        return self._get_parameter(b"NI", dest_addr_long=dest_addr_long)
+        return self._get_parameter(
+            b"NI", dest_addr_long=dest_addr_long, deadline=deadline,
+            cancel=cancel)
 
-    def get_temperature(self, dest_addr_long=None):
+    def get_temperature(
+            self, dest_addr_long=None, deadline=None, cancel=None):
         """
         Fetches and returns the degrees Celcius value measured by the XBee Pro
         module.
         """
         return hex_to_int(self._get_parameter(
-            b"TP", dest_addr_long=dest_addr_long))
+            b"TP", dest_addr_long=dest_addr_long, deadline=deadline,
+            cancel=cancel))
 
-    def get_temperature_fahrenheit(self, dest_addr_long=None):
+    def get_temperature_fahrenheit(
+            self, dest_addr_long=None, deadline=None, cancel=None):
         """
         Fetches and returns the degrees Fahrenheit value measured by the XBee
         Pro module.
         """
-        return int(((self.get_temperature(dest_addr_long) * 9.0) / 5) + 32)
+        return int(((self.get_temperature(
+            dest_addr_long, deadline=deadline, cancel=cancel) * 9.0) / 5) + 32)
@@ -61,3 +61,27 @@ class ZigBeePinNotConfigured(ZigBeeException):
     An operation was attempted on a GPIO pin which it was not configured for.
     """
     pass
+
+
+class ZigBeeBaudRateError(ZigBeeException):
+    """
+    The serial link to the local device could not be re-established after an
+    attempt to change its baud rate.
+    """
+    pass
+
+
+class ZigBeeCancelled(ZigBeeException):
+    """
+    The request was cancelled through its CancelToken before a response
+    arrived.
+    """
+    pass
+
+
+class ZigBeeFrameIdsExhausted(ZigBeeException):
+    """
+    Every frame ID is in use by a request which is still awaiting its
+    response.
+    """
+    pass
@@ -0,0 +1,269 @@
+"""
+xbee_helper.recorder
+
+Append-only binary log of IO samples, split into segment files of fixed width
+records which are read back through mmap without any text parsing.
+
+Each record holds a timestamp, the 64 bit source address (0 for the local
+device), a mask of which digital pins were sampled, a mask of their values and
+one word per analog pin in const.ANALOG_PINS (ADC_ABSENT if not sampled).
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from xbee_helper import const
+from xbee_helper.convert import hex_to_int
+
+
+MAGIC = b"XBSL\x01\x00\x00\x00"
+RECORD = struct.Struct("<qQHH%dH" % len(const.ANALOG_PINS))
+TIMESTAMP = struct.Struct("<q")
+ADC_ABSENT = 0xFFFF
+SEGMENT_SUFFIX = ".samples"
+
+
+def pack_sample(sample):
+    """
+    Convert a sample dict into its digital pin mask, digital value mask and
+    list of analog words.
+    """
+    dio_mask = dio_values = 0
+    for i, pin in enumerate(const.DIGITAL_PINS):
+        if pin in sample:
+            dio_mask |= 1 << i
+            if sample[pin]:
+                dio_values |= 1 << i
+    adc = [sample.get(pin, ADC_ABSENT) for pin in const.ANALOG_PINS]
+    return dio_mask, dio_values, adc
+
+
+def unpack_sample(dio_mask, dio_values, adc):
+    """
+    Rebuild a sample dict from the fields produced by pack_sample.
+    """
+    sample = {}
+    for i, pin in enumerate(const.DIGITAL_PINS):
+        if dio_mask & (1 << i):
+            sample[pin] = bool(dio_values & (1 << i))
+    for pin, value in zip(const.ANALOG_PINS, adc):
+        if value != ADC_ABSENT:
+            sample[pin] = value
+    return sample
+
+
+def _encode(micros, source, sample):
+    """
+    Pack a sample dict, timestamped in microseconds since the epoch, into a
+    record.
+    """
+    dio_mask, dio_values, adc = pack_sample(sample)
+    return RECORD.pack(micros, source, dio_mask, dio_values, *adc)
+
+
+class SampleRecord(namedtuple(
+        "SampleRecord", "timestamp source dio_mask dio_values adc")):
+    """
+    A single sample read back from a SampleLog. `timestamp` is in seconds
+    since the epoch and `source` is the 64 bit address as an integer.
+    """
+    __slots__ = ()
+
+    def to_sample(self):
+        """
+        Rebuild the sample dict in the same form returned by
+        ZigBee.get_sample.
+        """
+        return unpack_sample(self.dio_mask, self.dio_values, self.adc)
+
+    def pin_value(self, pin):
+        """
+        Return the value of the named pin, or None if it wasn't sampled.
+        """
+        if pin in const.DIGITAL_PINS:
+            bit = 1 << const.DIGITAL_PINS.index(pin)
+            return bool(self.dio_values & bit) if self.dio_mask & bit else None
+        value = self.adc[const.ANALOG_PINS.index(pin)]
+        return None if value == ADC_ABSENT else value
+
+
+def _decode(buf, offset):
+    fields = RECORD.unpack_from(buf, offset)
+    return SampleRecord(
+        fields[0] / 1000000.0, fields[1], fields[2], fields[3],
+        tuple(fields[4:]))
+
+
+def _segment_paths(path):
+    return sorted(
+        os.path.join(path, name) for name in os.listdir(path)
+        if name.endswith(SEGMENT_SUFFIX))
+
+
+def _last_micros(segments):
+    """
+    Return the timestamp in microseconds of the last whole record in the
+    newest of `segments` which has one, or 0 if none do.
+    """
+    for segment in reversed(segments):
+        count = (os.path.getsize(segment) - len(MAGIC)) // RECORD.size
+        if count > 0:
+            with open(segment, "rb") as fobj:
+                fobj.seek(len(MAGIC) + (count - 1) * RECORD.size)
+                return TIMESTAMP.unpack(fobj.read(TIMESTAMP.size))[0]
+    return 0
+
+
+class SampleRecorder(object):
+    """
+    Writes IO samples to segmented, append-only binary files in `path`.
+
+    Register `frame_received` with ZigBee.add_frame_rx_handler to record both
+    the samples returned by get_sample and IO frames pushed by remote
+    devices. Records must be in time order for SampleLog's range scans to
+    work, so a timestamp earlier than the previous one (including the last
+    one written to `path` before a restart) is clamped to it.
+    """
+    def __init__(
+            self, path, segment_records=const.SAMPLE_LOG_SEGMENT_RECORDS):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._path = path
+        self._segment_records = segment_records
+        self._file = None
+        self._count = 0
+        self._lock = threading.Lock()
+        segments = _segment_paths(path)
+        self._last_micros = _last_micros(segments)
+        self._next_segment = int(os.path.basename(
+            segments[-1])[:-len(SEGMENT_SUFFIX)]) + 1 if segments else 0
+
+    def _open_segment(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = open(os.path.join(
+            self._path, "%010d%s" % (self._next_segment, SEGMENT_SUFFIX)),
+            "wb")
+        self._file.write(MAGIC)
+        self._next_segment += 1
+        self._count = 0
+
+    def record(self, sample, source=None, timestamp=None):
+        """
+        Append a sample dict. `source` is the device's dest_addr_long (None
+        for the local device) and `timestamp` defaults to now.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        address = hex_to_int(source) if source else 0
+        with self._lock:
+            # Clamp in the stored units so rounding can't undo it.
+            micros = max(int(timestamp * 1000000), self._last_micros)
+            self._last_micros = micros
+            if self._file is None or self._count >= self._segment_records:
+                self._open_segment()
+            self._file.write(_encode(micros, address, sample))
+            self._file.flush()
+            self._count += 1
+
+    def frame_received(self, frame):
+        """
+        Frame handler which records the samples carried by IS responses and
+        IO sample frames.
+        """
+        if frame.get("id") == "rx_io_data_long_addr":
+            samples = frame.get("samples", [])
+        elif (frame.get("id") in ("at_response", "remote_at_response") and
+              frame.get("command", b"").upper() == b"IS" and
+              frame.get("status") == b"\x00"):
+            samples = frame.get("parameter", [])
+        else:
+            return
+        for sample in samples:
+            self.record(sample, source=frame.get("source_addr_long"))
+
+    def close(self):
+        """
+        Close the current segment file.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class SampleLog(object):
+    """
+    Reads the segments written by SampleRecorder. Each segment is mapped into
+    memory and records are unpacked in place, with binary searches on the
+    timestamps to find the start of a time range.
+    """
+    def __init__(self, path):
+        self._path = path
+
+    @staticmethod
+    def _bounds(buf, start, end):
+        """
+        Return the first and last+1 record indexes within [start, end) in a
+        mapped segment, along with its total record count.
+        """
+        count = (len(buf) - len(MAGIC)) // RECORD.size
+
+        def first_at_or_after(timestamp):
+            low, high = 0, count
+            while low < high:
+                mid = (low + high) // 2
+                if TIMESTAMP.unpack_from(
+                        buf, len(MAGIC) + mid * RECORD.size)[0] < timestamp:
+                    low = mid + 1
+                else:
+                    high = mid
+            return low
+
+        first = 0 if start is None else first_at_or_after(
+            int(start * 1000000))
+        last = count if end is None else first_at_or_after(
+            int(end * 1000000))
+        return first, last, count
+
+    def scan(self, start=None, end=None, source=None, pin=None):
+        """
+        Yield the SampleRecords timestamped within [start, end) (seconds
+        since the epoch), optionally only those from `source` (a
+        dest_addr_long, or 0 for the local device) and/or those in which the
+        named `pin` was sampled.
+        """
+        if isinstance(source, bytes):
+            source = hex_to_int(source)
+        for segment in _segment_paths(self._path):
+            with open(segment, "rb") as fobj:
+                if os.fstat(fobj.fileno()).st_size < len(MAGIC) + RECORD.size:
+                    continue
+                buf = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if buf[:len(MAGIC)] != MAGIC:
+                    raise ValueError("%s is not a sample log segment." % (
+                        segment,))
+                first, last, count = self._bounds(buf, start, end)
+                for i in range(first, last):
+                    record = _decode(buf, len(MAGIC) + i * RECORD.size)
+                    if source is not None and record.source != source:
+                        continue
+                    if pin is not None and record.pin_value(pin) is None:
+                        continue
+                    yield record
+                if last < count:
+                    # The rest of the log is after the end of the range.
+                    return
+            finally:
+                buf.close()
+
+    def pin_history(self, pin, start=None, end=None, source=None):
+        """
+        Yield (timestamp, value) pairs for the named pin within [start, end).
+        """
+        for record in self.scan(start, end, source, pin):
+            yield record.timestamp, record.pin_value(pin)
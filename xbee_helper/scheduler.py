@@ -0,0 +1,237 @@
+"""
+xbee_helper.scheduler
+
+Periodically polls health metrics from nodes on the network, spreading the
+requests out over time and capping how many are in flight at once.
+"""
+import heapq
+import logging
+import random
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from xbee_helper import cancellation
+from xbee_helper import const
+from xbee_helper import exceptions
+
+
+_LOGGER = logging.getLogger(__name__)
+
+# Metric names accepted by HealthScheduler.add and the ZigBee methods which
+# fetch them.
+METRICS = {
+    "supply_voltage": "get_supply_voltage",
+    "temperature": "get_temperature",
+    "sample": "get_sample",
+    "node_name": "get_node_name"
+}
+# Fraction of the golden ratio used to spread the first run of each job
+# evenly across its interval, whatever order the jobs were added in.
+_SPREAD = 0.6180339887498949
+
+HealthResult = namedtuple(
+    "HealthResult", "dest_addr_long metric value error timestamp")
+
+
+def _seconds(value):
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class _Job(object):
+    # pylint: disable=too-few-public-methods
+    def __init__(self, dest_addr_long, metric, interval):
+        self.dest_addr_long = dest_addr_long
+        self.metric = metric
+        self.interval = interval
+        self.anchor = None
+        self.due = None
+        self.removed = False
+
+
+class HealthScheduler(object):
+    """
+    Runs each (node, metric) job added to it once per interval on up to
+    `max_in_flight` worker threads.
+
+    Each job's first run is offset so that jobs sharing an interval are spread
+    evenly across it, and every run after that is jittered by up to `jitter`
+    of the interval. A node which fails is backed off exponentially, up to
+    `max_backoff`, until it next succeeds. Each request is given `timeout`
+    seconds (or timedelta), const.RX_TIMEOUT if None. Results are passed as
+    HealthResult tuples to `callback` and/or put on `queue`.
+    """
+    # The options mirror the const defaults they override, and the heap,
+    # backoff and worker state is simplest kept side by side.
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(
+            self, zigbee, callback=None, queue=None,
+            max_in_flight=const.SCHEDULER_MAX_IN_FLIGHT,
+            jitter=const.SCHEDULER_JITTER,
+            max_backoff=const.SCHEDULER_MAX_BACKOFF, timeout=None):
+        self._zigbee = zigbee
+        self._callback = callback
+        self._queue = queue
+        self._max_in_flight = max_in_flight
+        self._jitter = jitter
+        self._max_backoff = _seconds(max_backoff)
+        self._timeout = None if timeout is None else timedelta(
+            seconds=_seconds(timeout))
+        self._jobs = {}
+        self._heap = []
+        self._sequence = 0
+        self._failures = {}
+        self._backoff_until = {}
+        self._cond = threading.Condition()
+        self._running = False
+        self._cancel = None
+        self._threads = []
+
+    def _push(self, job):
+        """
+        Put a job on the heap. Must be called with self._cond held.
+        """
+        self._sequence += 1
+        heapq.heappush(self._heap, (job.due, self._sequence, job))
+        self._cond.notify()
+
+    def add(self, dest_addr_long, metric, interval):
+        """
+        Poll `metric` (one of METRICS) from a node every `interval` seconds
+        (or timedelta). Replaces any existing job for the same node and
+        metric.
+        """
+        if metric not in METRICS:
+            raise ValueError("Unknown metric %r." % (metric,))
+        job = _Job(dest_addr_long, metric, _seconds(interval))
+        with self._cond:
+            self.remove(dest_addr_long, metric)
+            self._jobs[(dest_addr_long, metric)] = job
+            phase = (len(self._jobs) * _SPREAD) % 1
+            job.anchor = job.due = time.time() + phase * job.interval
+            self._push(job)
+
+    def remove(self, dest_addr_long, metric):
+        """
+        Stop polling `metric` from a node.
+        """
+        with self._cond:
+            job = self._jobs.pop((dest_addr_long, metric), None)
+            if job is not None:
+                job.removed = True
+
+    def start(self):
+        """
+        Start the worker threads.
+        """
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._cancel = cancellation.CancelToken()
+        self._threads = [
+            threading.Thread(target=self._run, name="HealthScheduler")
+            for _ in range(self._max_in_flight)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        """
+        Stop the worker threads, cancelling any requests in flight.
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+            if self._cancel is not None:
+                self._cancel.cancel()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _next_job(self):
+        """
+        Wait for the earliest job to fall due and take it off the heap.
+        Returns None once the scheduler has been stopped.
+        """
+        with self._cond:
+            while self._running:
+                if self._heap and self._heap[0][2].removed:
+                    heapq.heappop(self._heap)
+                    continue
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    job = heapq.heappop(self._heap)[2]
+                    until = self._backoff_until.get(job.dest_addr_long, 0)
+                    if until <= now:
+                        return job
+                    # Skip the node's other jobs while it's backed off.
+                    job.due = job.anchor = until
+                    self._push(job)
+                    continue
+                self._cond.wait(
+                    self._heap[0][0] - now if self._heap else None)
+        return None
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            value = error = None
+            try:
+                value = getattr(self._zigbee, METRICS[job.metric])(
+                    dest_addr_long=job.dest_addr_long, deadline=self._timeout,
+                    cancel=self._cancel)
+            except exceptions.ZigBeeCancelled:
+                # Stopped mid-request; leave the job as it was.
+                with self._cond:
+                    self._push(job)
+                return
+            except exceptions.ZigBeeException as exc:
+                error = exc
+            except Exception as exc:  # pylint: disable=broad-except
+                # Serial errors, malformed frames etc. mustn't kill the
+                # worker, so back the node off like any other failure.
+                _LOGGER.exception(
+                    "Unexpected error fetching %s from %r.",
+                    job.metric, job.dest_addr_long)
+                error = exc
+            self._reschedule(job, error)
+            self._deliver(HealthResult(
+                job.dest_addr_long, job.metric, value, error, time.time()))
+
+    def _reschedule(self, job, error):
+        with self._cond:
+            now = time.time()
+            if error is None:
+                self._failures.pop(job.dest_addr_long, None)
+                self._backoff_until.pop(job.dest_addr_long, None)
+                job.anchor = max(job.anchor + job.interval, now)
+                job.due = job.anchor + job.interval * random.uniform(
+                    -self._jitter, self._jitter)
+            else:
+                failures = self._failures.get(job.dest_addr_long, 0) + 1
+                self._failures[job.dest_addr_long] = failures
+                _LOGGER.debug(
+                    "Backing off %r after %s failure(s): %s",
+                    job.dest_addr_long, failures, error)
+                # Cap the exponent so that a node which stays down for days
+                # can't overflow the multiplication.
+                job.due = job.anchor = now + min(
+                    job.interval * 2 ** min(failures, 32), self._max_backoff)
+                self._backoff_until[job.dest_addr_long] = job.due
+            if not job.removed:
+                self._push(job)
+
+    def _deliver(self, result):
+        if self._callback is not None:
+            try:
+                self._callback(result)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Health result callback failed.")
+        if self._queue is not None:
+            self._queue.put(result)
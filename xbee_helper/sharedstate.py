@@ -0,0 +1,318 @@
+"""
+xbee_helper.sharedstate
+
+A table of the latest sample and health values of each node, kept in a memory
+mapped file so that any local process can read the current state of the
+network without radio traffic or asking the process which owns the serial
+port.
+
+The owning process creates the table and registers `frame_received` with
+ZigBee.add_frame_rx_handler. Each node has a fixed size slot, found by open
+addressing on its 64 bit address (0 for the local device), which the single
+writer updates under a seqlock. Readers retry until they see an even, unchanged
+sequence number, so they never block the writer or each other. A reader gives
+up after const.SHARED_STATE_READ_TIMEOUT, in case the writer died mid-update.
+
+The header has a seqlock of its own, taken when the table is re-created, so
+that readers which keep it mapped pick up a changed slot count.
+"""
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from xbee_helper import const
+from xbee_helper.convert import hex_to_int, supply_voltage_to_volts
+from xbee_helper.recorder import ADC_ABSENT, pack_sample, unpack_sample
+
+
+MAGIC = b"XBST\x01\x00\x00\x00"
+HEADER = struct.Struct("<8sII")
+HEADER_SIZE = 64
+SEQ = struct.Struct("<I")
+HEADER_SEQ_OFFSET = HEADER.size
+_SLOT_FIELDS = "<IIQqHH%dHdd" % len(const.ANALOG_PINS)
+# Pad slots out to a whole number of cache lines.
+SLOT = struct.Struct("%s%dx" % (
+    _SLOT_FIELDS, -struct.calcsize(_SLOT_FIELDS) % 64))
+FLAG_PRESENT = 0x01
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+NodeState = namedtuple(
+    "NodeState", "address updated sample supply_voltage temperature")
+
+
+def _slot_hash(address, slots):
+    return ((address * _HASH_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) % slots
+
+
+def _address(dest_addr_long):
+    return hex_to_int(dest_addr_long) if dest_addr_long else 0
+
+
+def _optional(value):
+    return None if math.isnan(value) else value
+
+
+class SharedStateTable(object):
+    """
+    Latest value table mapped from `path`. Pass `create=True` in the process
+    which owns the radio to (re)initialise the table with room for `slots`
+    nodes; every other process opens it read-only.
+
+    An existing table is reinitialised in place, and the file is only ever
+    grown, so that readers which still have it mapped see empty slots rather
+    than losing the pages underneath them.
+    """
+    def __init__(
+            self, path=const.SHARED_STATE_PATH,
+            slots=const.SHARED_STATE_SLOTS, create=False):
+        self._path = path
+        self._writable = create
+        self._lock = threading.Lock()
+        self._index = {}
+        self._values = {}
+        self._buf = None
+        self._map(slots)
+        if create:
+            self._initialise(slots)
+        magic, _, slot_size = HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC or slot_size != SLOT.size:
+            self._buf.close()
+            raise ValueError("%s is not a compatible shared state table." % (
+                path,))
+
+    def _map(self, slots):
+        """
+        Map the file, first growing it to hold `slots` if we're the writer.
+        """
+        if self._writable:
+            fobj = os.fdopen(
+                os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644), "r+b")
+        else:
+            fobj = open(self._path, "rb")
+        with fobj:
+            if self._writable and os.fstat(
+                    fobj.fileno()).st_size < self._offset(slots):
+                fobj.truncate(self._offset(slots))
+            # The old mapping is left for the garbage collector, since other
+            # threads may still be reading from it.
+            self._buf = mmap.mmap(
+                fobj.fileno(), 0, access=mmap.ACCESS_WRITE
+                if self._writable else mmap.ACCESS_READ)
+
+    @staticmethod
+    def _offset(index):
+        return HEADER_SIZE + index * SLOT.size
+
+    def _initialise(self, slots):
+        """
+        Empty every slot in the file under its seqlock, so that readers
+        mid-read retry, then write the header under its own.
+        """
+        header_seq = self._begin_write(HEADER_SEQ_OFFSET)
+        empty = b"\x00" * (SLOT.size - SEQ.size)
+        for index in range((len(self._buf) - HEADER_SIZE) // SLOT.size):
+            offset = self._offset(index)
+            seq = self._begin_write(offset)
+            self._buf[offset + SEQ.size:offset + SLOT.size] = empty
+            SEQ.pack_into(self._buf, offset, (seq + 1) & 0xFFFFFFFF)
+        HEADER.pack_into(self._buf, 0, MAGIC, slots, SLOT.size)
+        SEQ.pack_into(
+            self._buf, HEADER_SEQ_OFFSET, (header_seq + 1) & 0xFFFFFFFF)
+
+    def _begin_write(self, offset):
+        """
+        Step the seqlock at `offset` to its next odd value and return it. A
+        writer which died mid-update may have left it odd already.
+        """
+        seq = ((SEQ.unpack_from(self._buf, offset)[0] + 1) | 1) & 0xFFFFFFFF
+        SEQ.pack_into(self._buf, offset, seq)
+        return seq
+
+    def _slot_count(self):
+        """
+        Current number of slots, remapping the file if the table has been
+        re-created larger since we mapped it.
+        """
+        slots = HEADER.unpack_from(self._buf, 0)[1]
+        if self._offset(slots) > len(self._buf):
+            self._map(slots)
+        return slots
+
+    def _consistent(self, offset, read):
+        """
+        Call `read` until it completes without the seqlock at `offset`
+        changing, and return its result.
+        """
+        give_up = None
+        while True:
+            seq = SEQ.unpack_from(self._buf, offset)[0]
+            if not seq & 1:
+                result = read()
+                if SEQ.unpack_from(self._buf, offset)[0] == seq:
+                    return result
+            now = time.time()
+            if give_up is None:
+                give_up = now + const.SHARED_STATE_READ_TIMEOUT.total_seconds()
+            elif now > give_up:
+                raise IOError(
+                    "Timed out reading shared state table offset %d." % (
+                        offset,))
+            time.sleep(0)
+
+    def _read_slot(self, index):
+        """
+        Take a consistent copy of a slot's fields using the seqlock.
+        """
+        offset = self._offset(index)
+        return self._consistent(
+            offset, lambda: SLOT.unpack_from(self._buf, offset))
+
+    def _find(self, address):
+        """
+        Return the index of the slot holding `address`, or of the empty slot
+        it would be stored in, or None if the table is full.
+        """
+        return self._consistent(
+            HEADER_SEQ_OFFSET, lambda: self._probe(address))
+
+    def _probe(self, address):
+        slots = self._slot_count()
+        index = _slot_hash(address, slots)
+        for _ in range(slots):
+            fields = self._read_slot(index)
+            if not fields[1] & FLAG_PRESENT or fields[2] == address:
+                return index
+            index = (index + 1) % slots
+        return None
+
+    def _write(self, address, timestamp, values):
+        """
+        Merge `values` into the node's slot under the seqlock.
+        """
+        if not self._writable:
+            raise IOError("Shared state table was not opened for writing.")
+        with self._lock:
+            return self._write_locked(address, timestamp, values)
+
+    def _write_locked(self, address, timestamp, values):
+        index = self._index.get(address)
+        if index is None:
+            index = self._find(address)
+            if index is None:
+                return False
+            self._index[address] = index
+        current = self._values.setdefault(address, dict(
+            dio_mask=0, dio_values=0,
+            adc=[ADC_ABSENT] * len(const.ANALOG_PINS),
+            supply_voltage=float("nan"), temperature=float("nan")))
+        current.update(values)
+        offset = self._offset(index)
+        seq = (SEQ.unpack_from(self._buf, offset)[0] + 1) & 0xFFFFFFFF
+        SEQ.pack_into(self._buf, offset, seq)
+        SLOT.pack_into(
+            self._buf, offset, seq, FLAG_PRESENT, address,
+            int((timestamp or time.time()) * 1000000),
+            current["dio_mask"], current["dio_values"],
+            *(list(current["adc"]) + [
+                current["supply_voltage"], current["temperature"]]))
+        SEQ.pack_into(self._buf, offset, (seq + 1) & 0xFFFFFFFF)
+        return True
+
+    def update_sample(self, dest_addr_long, sample, timestamp=None):
+        """
+        Publish the latest sample dict of a node. Returns False if the table
+        is full.
+        """
+        dio_mask, dio_values, adc = pack_sample(sample)
+        return self._write(_address(dest_addr_long), timestamp, dict(
+            dio_mask=dio_mask, dio_values=dio_values, adc=adc))
+
+    def update_health(
+            self, dest_addr_long, supply_voltage=None, temperature=None,
+            timestamp=None):
+        """
+        Publish the latest supply voltage and/or temperature of a node.
+        Returns False if the table is full.
+        """
+        values = {}
+        if supply_voltage is not None:
+            values["supply_voltage"] = supply_voltage
+        if temperature is not None:
+            values["temperature"] = temperature
+        return self._write(_address(dest_addr_long), timestamp, values)
+
+    def frame_received(self, frame):
+        """
+        Frame handler which publishes the samples carried by IO sample frames
+        and IS responses, and the values in %V and TP responses.
+        """
+        source = frame.get("source_addr_long")
+        if frame.get("id") == "rx_io_data_long_addr":
+            for sample in frame.get("samples", []):
+                self.update_sample(source, sample)
+            return
+        if frame.get("id") not in ("at_response", "remote_at_response") or \
+                frame.get("status") != b"\x00" or "parameter" not in frame:
+            return
+        command = frame.get("command", b"").upper()
+        if command == b"IS":
+            for sample in frame["parameter"]:
+                self.update_sample(source, sample)
+        elif command == b"%V":
+            self.update_health(
+                source,
+                supply_voltage=supply_voltage_to_volts(frame["parameter"]))
+        elif command == b"TP":
+            self.update_health(
+                source, temperature=hex_to_int(frame["parameter"]))
+
+    def get(self, dest_addr_long=None):
+        """
+        Return the NodeState of a node (None for the local device), or None
+        if nothing has been published for it.
+        """
+        address = _address(dest_addr_long)
+        index = self._find(address)
+        if index is None:
+            return None
+        fields = self._read_slot(index)
+        if not fields[1] & FLAG_PRESENT:
+            return None
+        return self._node_state(fields)
+
+    def nodes(self):
+        """
+        Yield the NodeState of every node in the table.
+        """
+        for state in self._consistent(HEADER_SEQ_OFFSET, self._node_states):
+            yield state
+
+    def _node_states(self):
+        states = []
+        for index in range(self._slot_count()):
+            fields = self._read_slot(index)
+            if fields[1] & FLAG_PRESENT:
+                states.append(self._node_state(fields))
+        return states
+
+    @staticmethod
+    def _node_state(fields):
+        adc_end = 6 + len(const.ANALOG_PINS)
+        return NodeState(
+            address=fields[2],
+            updated=fields[3] / 1000000.0,
+            sample=unpack_sample(fields[4], fields[5], fields[6:adc_end]),
+            supply_voltage=_optional(fields[adc_end]),
+            temperature=_optional(fields[adc_end + 1]))
+
+    def close(self):
+        """
+        Unmap the table.
+        """
+        self._buf.close()
@@ -0,0 +1,126 @@
+"""
+xbee_helper.transmit
+
+Support classes for sending application data frames with
+ZigBee.send_data and tracking them until their tx_status frames arrive.
+"""
+import threading
+
+from xbee_helper import exceptions
+
+
+def fragment(payload, size):
+    """
+    Split a payload into chunks of at most `size` bytes. An empty payload is
+    still sent as a single (empty) frame.
+    """
+    if size < 1:
+        raise ValueError("Fragment size must be at least 1 byte.")
+    return [payload[i:i+size] for i in range(0, len(payload), size)] or [
+        payload]
+
+
+class TxFuture(object):
+    """
+    The eventual delivery status of a payload passed to ZigBee.send_data.
+
+    Resolves to the list of tx_status frames (one per fragment, in the order
+    they were acknowledged) once every fragment has been delivered, or to the
+    exception raised for the first fragment which could not be.
+    """
+    def __init__(self, fragments):
+        self._remaining = fragments
+        self._frames = []
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def done(self):
+        """
+        Whether the transfer has finished, successfully or otherwise.
+        """
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the transfer to finish and return its tx_status frames,
+        raising the exception which stopped it if it failed.
+        """
+        exc = self.exception(timeout)
+        if exc is not None:
+            raise exc
+        return self._frames
+
+    def exception(self, timeout=None):
+        """
+        Wait for the transfer to finish and return the exception which stopped
+        it, or None if it succeeded.
+        """
+        if not self._done.wait(timeout):
+            raise exceptions.ZigBeeResponseTimeout()
+        return self._exception
+
+    def add_done_callback(self, callback):
+        """
+        Adds a function to be called with this future once it is done. If it
+        is already done, the function is called straight away.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def fragment_delivered(self, frame):
+        """
+        Record the successful tx_status frame for one of the fragments.
+        """
+        with self._lock:
+            if self._done.is_set():
+                return
+            self._frames.append(frame)
+            self._remaining -= 1
+            if self._remaining > 0:
+                return
+            callbacks = self._finish()
+        self._run_callbacks(callbacks)
+
+    def set_exception(self, exc):
+        """
+        Fail the transfer. Ignored if it has already finished.
+        """
+        with self._lock:
+            if self._done.is_set():
+                return
+            self._exception = exc
+            callbacks = self._finish()
+        self._run_callbacks(callbacks)
+
+    def _finish(self):
+        """
+        Mark the future as done and hand back the callbacks to run. Must be
+        called with self._lock held.
+        """
+        self._done.set()
+        callbacks, self._callbacks = self._callbacks, []
+        return callbacks
+
+    def _run_callbacks(self, callbacks):
+        for callback in callbacks:
+            callback(self)
+
+
+class PendingFragment(object):
+    """
+    A single fragment of a transfer which has been handed to the radio and is
+    awaiting its tx_status frame.
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, future, dest_addr_long, data, retries, deadline=None):
+        self.future = future
+        self.dest_addr_long = dest_addr_long
+        self.data = data
+        self.retries = retries
+        self.deadline = deadline
+        self.expires = None